@@ -1,7 +1,35 @@
 from imdb import IMDb, IMDbError
 from pythonopensubtitles.opensubtitles import OpenSubtitles
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import gzip
 import os
-import pickle
+import sqlite3
+import threading
+import time
+from xmlrpc.client import ServerProxy
+
+from SubDownloader.accounts import AccountPool
+from SubDownloader.cache import SubtitleCache
+from SubDownloader.episodes import EpisodeTable
+from SubDownloader.jobs import DownloadJob, PENDING, SEARCHED, RESOLVED, DOWNLOADED, SAVED, MISSING, DUPLICATE
+from SubDownloader.lookup_cache import LookupCache
+from SubDownloader.meta_store import MetaStore
+from SubDownloader.ranking import choose_subtitles
+import SubDownloader.utils as utl
+from SubDownloader.metrics import NULL_METRICS
+
+
+def _last_status(client):
+    """ Returns the status of the last OpenSubtitles reply, e.g. '407 Download limit reached' """
+    data = getattr(client, 'data', None)
+    if isinstance(data, dict):
+        return str(data.get('status', ''))
+    return ''
+
+
+class TitleNotFound(Exception):
+    """ Raised by find when IMDB has nothing matching the search term """
 
 
 class SubDownloader(object):
@@ -10,16 +38,38 @@ class SubDownloader(object):
     the SRT files and save them
     """
 
-    def __init__(self, search_term = None, data_path = ".", verbose = 2):
+    def __init__(self, search_term = None, data_path = ".", verbose = 2,
+                 search_workers = 8, search_batch_size = 1, account_file = None,
+                 server_url = None, ia = None):
         """
         Initialize the SubDownloader object
+        
+        :param search_workers The number of threads used to search 
+            OpenSubtitles at the same time.
+        :param search_batch_size The number of IMDB ID's sent in each 
+            search call. OpenSubtitles caps a search at 500 results so 
+            large batches can lose episodes with many subtitles.
+        :param account_file A JSON file where the download counts and 
+            tokens of each account are kept between runs.
+        :param server_url The OpenSubtitles XML-RPC address, used to point 
+            at a local stand-in such as mock_server.MockServer.
+        :param ia The IMDB access object. Defaults to IMDb(), or pass a 
+            stand-in such as mock_server.MockIMDb.
             
         """
-        self.ost = OpenSubtitles()
-        self.ia = IMDb()
+        self.server_url = server_url
+        self.ost = self._new_client()
+        self.ia = ia if ia is not None else IMDb()
+        
+        self.search_workers = search_workers
+        self.search_batch_size = search_batch_size
+        self.download_batch_size = 19
+        self.retries = 3
+        self.retry_wait = 1.0
+        self._local = threading.local()
+        self._login_lock = threading.Lock()
         
-        self.password_array = []
-        self.used_accounts = []
+        self.accounts = AccountPool(account_file)
         self.data_path = data_path
         self.verbose = verbose
         
@@ -27,21 +77,37 @@ class SubDownloader(object):
         
         self.current_account = None
         
+        self.cache = None
+        self.lookup_cache = None
+        self.metrics = NULL_METRICS
+        self.dedup_index = None
+        
+
+    @property
+    def password_array(self):
+        """ The (username, password) of every account added """
+        return self.accounts.credentials()
+    
+    @property
+    def used_accounts(self):
+        """ The usernames that have run out of downloads """
+        return self.accounts.exhausted()
 
-    def add_login(self, username, password):
+    def add_login(self, username, password, quota = None):
         """
         Adds a user account for OpenSubtitles to the list of 
         possible accounts.
         
         Multiple accounts can be added to deal with hitting rate 
         limits in tokens.
+        
+        :param quota The number of downloads the account gets each day 
+            if it differs from the usual 200.
         """
         
-        if (username, password) in self.password_array:
+        if not self.accounts.add(username, password, quota = quota):
             self.ObjPrint("User already added", important = True)
             return -1
-        else:
-            self.password_array.append((username, password))
         
         
         
@@ -49,55 +115,76 @@ class SubDownloader(object):
         """
         Used to login to OpenSubtitles and collect API token.
         If a username and password are passed then they will be 
-        used to login. Else, the previously added logins will 
-        be used if they have not already been used in this session.
+        used to login. Else, the previously added account with the 
+        most downloads left is used.
+        
+        Tokens from earlier logins are reused while they are valid.
         """
         
         # If a manual user is passed to function
         if username is not None and password is not None:
-            token = self.ost.login(username, password)
+            # Add account to list of accounts
+            self.accounts.add(username, password)
+            token = self._use_account(username)
             if token is None:
                 raise Exception("Failed to collect token from manual pass")
-            else:  
-                # Save current account 
-                self.current_account = username
-                # Add account to list of accounts
-                if (username, password) not in self.password_array:
-                    self.password_array.append((username, password))
-                
-                # Add to list of used accounts
-                if username not in self.used_accounts:
-                        self.used_accounts.append(username)
-                        
-                return token
+            return token
                         
-        # Automatically login using a user that has not be used before.
-        if len(self.password_array) == 0:
+        # Automatically login using the user with the most downloads left.
+        if len(self.accounts) == 0:
             raise Exception("Can't log in with a username and password")
+        
+        usr = self.accounts.best()
+        if usr is None:
+            self.ObjPrint(["All accounts have used their downloads.",
+                  "The first will reset at", self.accounts.next_reset(),
+                  "Try running rate_limit_clean if this is wrong."], important = True)
+            return -1
+        
+        token = self._use_account(usr)
+        if token is None:
+            raise Exception("Failed to login using account " + usr)
+        return token
+    
+    def _use_account(self, username):
+        """
+        Switches the OpenSubtitles client to an account, logging in only 
+        if there isn't a valid token already. Returns the token.
+        """
+        token = self.accounts.get_token(username)
+        if token is None:
+            token = self.ost.login(username, self.accounts.passwords[username])
+            self.metrics.count('logins', account = username)
+            if token is None:
+                self.metrics.count('login_failures', account = username)
+                return None
+            self.accounts.set_token(username, token)
         else:
-            for usr, pwd in self.password_array: # Loop through each user
-                if usr not in self.used_accounts:  # Check for previous usage
-                    
-                    token = self.ost.login(usr, pwd)
-                    
-                    if token is None:
-                        raise Exception("Failed to login using a previously unused account")
-                    else:
-                        # Save current account 
-                        self.current_account = usr
-                        self.used_accounts.append(usr)
-                        return token
-            self.ObjPrint(["Reached end of loop through accounts.",
-                  "This suggests all accounts have been used.",
-                  "Try running rate_limit_clean to address issue.",
-                  "Meanwhile, first user has been used."], important = True)
-
-        usr, pwd = self.password_array[0]
-        token = self.ost.login(usr, pwd)
+            self.ost.token = token
+        
+        if self.current_account is not None and username != self.current_account:
+            self.metrics.count('account_switches')
         # Save current account 
-        self.current_account = usr
-        self.used_accounts.append(usr)
-        return -1
+        self.current_account = username
+        return token
+    
+    def _prepare_account(self):
+        """
+        Switches to the account with the most downloads left before a 
+        batch is sent. Returns how many subtitles the next batch can hold.
+        """
+        if len(self.accounts) == 0:
+            # Logged in some other way, nothing to track
+            return self.download_batch_size
+        
+        usr = self.accounts.best()
+        if usr is None:
+            raise Exception("Account Access Failed")
+        if usr != self.current_account or self.accounts.get_token(usr) is None:
+            if self._use_account(usr) is None:
+                raise Exception("Failed to login using account " + usr)
+        
+        return min(self.download_batch_size, self.accounts.remaining(usr))
         
     def get_current_login(self):
         """ Returns current login username """
@@ -108,13 +195,15 @@ class SubDownloader(object):
         Manually overides the rate limit avoidance framework. 
         Use if 24 hours have passed as the rate limits will reset.
         """
-        self.used_accounts = []
+        self.accounts.reset()
         
         
     def rate_limit_naughty_fix(self):
         """
         Avoids the rate limit by logining in with a different account.
         """
+        if self.current_account is not None:
+            self.accounts.mark_exhausted(self.current_account)
         return self.login()
         
     def remove_usr(self, username):
@@ -122,9 +211,9 @@ class SubDownloader(object):
         Removes a user from the list of possible accounts.
         Use this if something went wrong.
         """
-        for i, tup in self.password_array:
-            if tup[0] == username:
-                del self.password_array[i]
+        self.accounts.remove(username)
+        if self.current_account == username:
+            self.current_account = None
 
     
     def set_data_path(self, path):
@@ -134,13 +223,83 @@ class SubDownloader(object):
         self.data_path = path
         
     
+    def set_cache(self, path, max_bytes = 2**30):
+        """
+        Turns on the on disk subtitle cache at the given path. Cached 
+        episodes skip both the search and the download.
+        Pass None to turn the cache off.
+        """
+        if path is None:
+            self.cache = None
+        else:
+            self.cache = SubtitleCache(path, max_bytes = max_bytes)
+    
+    def set_lookup_cache(self, path, ttl = 7*24*60*60):
+        """
+        Turns on the SQLite cache of IMDB searches and episode lists. 
+        Entries older than ttl seconds are fetched again.
+        Pass None to turn the cache off.
+        """
+        if path is None:
+            self.lookup_cache = None
+        else:
+            self.lookup_cache = LookupCache(path, ttl = ttl)
+    
+    def invalidate_lookups(self, search_term = None, imdb_id = None):
+        """
+        Removes cached IMDB lookups for a search term and/or a series ID.
+        With no arguments the whole lookup cache is cleared.
+        """
+        if self.lookup_cache is None:
+            return
+        if search_term is None and imdb_id is None:
+            self.lookup_cache.invalidate()
+        if search_term is not None:
+            self.lookup_cache.invalidate(key = "search:"+search_term)
+        if imdb_id is not None:
+            self.lookup_cache.invalidate(key = "episodes:"+str(imdb_id))
+            self.lookup_cache.invalidate(prefix = "episodes:%s:" % imdb_id)
+    
+    def set_metrics(self, metrics):
+        """
+        Records timings and counts to a metrics.Metrics object. 
+        Pass None to stop recording.
+        """
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+    
+    def set_dedup_index(self, index):
+        """
+        Checks each download against a dedup.MinHashIndex. Near duplicates 
+        of a subtitle already in the index are not saved or returned, and 
+        are skipped without searching in later runs. The index is saved 
+        after each batch if it has a path. Pass None to turn it off.
+        """
+        self.dedup_index = index
+    
+    def _is_near_duplicate(self, name, subtitle, raw = False):
+        """ Adds a download to the dedup index, returns True if it duplicates another """
+        if raw:
+            subtitle = gzip.decompress(subtitle).decode("utf-8", "replace")
+        try:
+            tokens = utl.process_srt(subtitle)
+        except ValueError:
+            return False
+        if self.dedup_index.too_short(tokens):
+            return False
+        match = self.dedup_index.add_unique(name, tokens)
+        if match == str(name):
+            return False
+        self.ObjPrint([name, "is a near duplicate of", match, "~ Will not be saved."])
+        self.metrics.count('near_duplicates')
+        return True
+    
     def set_search_term(self, term):
         """ Sets the search term that will be used to find subtitles"""
         self.search_term = term
     
             
     
-    def find(self, search_term = None, force_series = False):    
+    def find(self, search_term = None, force_series = False, fetch_episodes = True):    
         """
         Searchs IMDB for media that matches the seach term. 
         Movies will return a list with the IMDB ID.
@@ -149,6 +308,8 @@ class SubDownloader(object):
         
         :param force_series will force the search to only return tv series.
             This should be used for reliability.
+        :param fetch_episodes False returns a series without its episodes, 
+            so they can be fetched a season at a time with iter_seasons.
             
         """
         # Dealing with search term
@@ -160,11 +321,17 @@ class SubDownloader(object):
                 
         
         # Performing Search
-        try:
-            search_results = self.ia.search_movie(self.search_term)
-        except IMDbError as err:
-            print("Something went wrong searching IMDB, process aborted.")
-            raise err
+        search_results = None
+        if self.lookup_cache is not None:
+            search_results = self.lookup_cache.get("search:"+self.search_term)
+        if search_results is None:
+            try:
+                search_results = self.ia.search_movie(self.search_term)
+            except IMDbError as err:
+                print("Something went wrong searching IMDB, process aborted.")
+                raise err
+            if self.lookup_cache is not None:
+                self.lookup_cache.put("search:"+self.search_term, search_results)
         
         # Viewing Results
         
@@ -187,118 +354,641 @@ class SubDownloader(object):
                      "\n If this is not the correct series then try using a different search term."])
                 
                 # Update to get the episodes
-                try:
-                    self.ia.update(result, 'episodes')
-                except IMDbError as e:
-                    print("Something went wrong getting the episodes, process aborted.")
-                    raise e  
+                if fetch_episodes:
+                    result = self._update_episodes(result)
                 
                 # If tv series is found and episodes are successfully downloaded then return
                 return result
         
         # If the end is reached without finding anything
-        raise Exception('Could not find any shows that matched the parameters.')
+        raise TitleNotFound('Could not find any shows that matched the parameters.')
                 
-    def find_from_id_tv_show(self, imdb_id):
-        """ Finds the IMDB Object based on a give IMDB ID """
+    def find_from_id_tv_show(self, imdb_id, fetch_episodes = True):
+        """
+        Finds the IMDB Object based on a give IMDB ID 
+        
+        :param fetch_episodes False returns the series without its episodes, 
+            see iter_seasons.
+        """
+        if fetch_episodes and self.lookup_cache is not None:
+            result = self.lookup_cache.get("episodes:"+str(imdb_id))
+            if result is not None:
+                return result
+        
         try:
             result = self.ia.get_movie(imdb_id)
+        except IMDbError as e:
+            print("Something went wrong getting the episodes, process aborted.")
+            raise e  
+        
+        if not fetch_episodes:
+            return result
+        return self._update_episodes(result, imdb_id)
+    
+    def _update_episodes(self, result, imdb_id = None):
+        """
+        Updates a series object to include its episodes, using the lookup 
+        cache when it has a copy.
+        """
+        if imdb_id is None:
+            imdb_id = result.movieID
+        key = "episodes:"+str(imdb_id)
+        
+        if self.lookup_cache is not None:
+            cached = self.lookup_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        try:
             self.ia.update(result, 'episodes')
         except IMDbError as e:
             print("Something went wrong getting the episodes, process aborted.")
             raise e  
-
+        
+        if self.lookup_cache is not None:
+            self.lookup_cache.put(key, result)
         return result
+    
+    def _fetch_season(self, imdb_id, season):
+        """ Returns a dictionary of episode number, episode for one season of a series """
+        key = "episodes:%s:%s" % (imdb_id, season)
+        if self.lookup_cache is not None:
+            cached = self.lookup_cache.get(key)
+            if cached is not None:
+                return cached
         
+        try:
+            # IMDbPy may list seasons as numbers or strings, so ask for both
+            data = self.ia.get_movie_episodes(imdb_id, season_nums = set([season, str(season)]))
+        except IMDbError as e:
+            print("Something went wrong getting season", season, ", process aborted.")
+            raise e
         
+        episodes = {}
+        for season_episodes in data.get('data', {}).get('episodes', {}).values():
+            episodes.update(season_episodes)
         
-    def download_opensubtitles(self, imdb_ids, save = False, new_data_path = None):
+        if self.lookup_cache is not None:
+            self.lookup_cache.put(key, episodes)
+        return episodes
+    
+    def _update_seasons(self, series):
         """
-        Takes some IMDB ID's and downloads the first english subtitle 
-        search results as SRT files.
+        Updates a series object with its main information, which holds 
+        the list of seasons, using the lookup cache when it has a copy.
+        """
+        key = "episodes:%s:seasons" % series.movieID
+        if self.lookup_cache is not None:
+            seasons = self.lookup_cache.get(key)
+            if seasons is not None:
+                series.data['seasons'] = seasons
+                return series
         
-        Ideally this function takes all the episode ID's. This allows 
-        the program to collect the subtitles 
-        in bunches to avoid hitting rate limits. Each call can make 
-        20 requests for subtitles in one.
+        try:
+            self.ia.update(series, 'main')
+        except IMDbError as e:
+            print("Something went wrong getting the seasons, process aborted.")
+            raise e
+        
+        if self.lookup_cache is not None and 'seasons' in series:
+            self.lookup_cache.put(key, series['seasons'])
+        return series
+    
+    def iter_seasons(self, series, workers = 4):
         """
+        Lazily yields (season, dictionary of episode number, episode) for 
+        a series in season order. Up to workers seasons are fetched from 
+        IMDB at once, so the first season can be used while later ones 
+        are still being fetched.
+        
+        A series that already has its episodes, or an IMDB access object 
+        without get_movie_episodes, falls back to fetching every season 
+        in one go.
+        """
+        if 'episodes' not in series and 'seasons' not in series and hasattr(self.ia, 'get_movie_episodes'):
+            # Search results don't list the seasons, the main page does
+            series = self._update_seasons(series)
+        seasons = series.get('seasons') or []
+        try:
+            seasons = sorted(int(season) for season in seasons)
+        except ValueError:
+            seasons = []
+        
+        if 'episodes' in series or len(seasons) == 0 or not hasattr(self.ia, 'get_movie_episodes'):
+            if 'episodes' not in series:
+                series = self._update_episodes(series)
+            for season, episodes in series['episodes'].items():
+                yield season, episodes
+            return
+        
+        with ThreadPoolExecutor(max_workers = max(1, workers)) as pool:
+            futures = [pool.submit(self._fetch_season, series.movieID, season) for season in seasons]
+            for season, future in zip(seasons, futures):
+                with self.metrics.timer('season'):
+                    episodes = future.result()
+                yield season, episodes
+        
+        
+        
+    def _new_client(self):
+        """ Makes an OpenSubtitles client for the configured server """
+        client = OpenSubtitles()
+        if self.server_url is not None:
+            client.xmlrpc = ServerProxy(self.server_url, allow_none = True)
+        return client
+    
+    def _search_client(self):
+        """
+        Returns an OpenSubtitles client for the current thread which 
+        shares the token of the logged in client. The XML-RPC proxy 
+        can't be shared between threads.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self.ost
+        client = getattr(self._local, 'ost', None)
+        if client is None or client.token != self.ost.token:
+            client = self._new_client()
+            client.token = self.ost.token
+            self._local.ost = client
+        return client
+    
+    def _search_login(self, client):
+        """
+        Logs the current account in again after a search was refused, 
+        unless another thread already has. Gives client the new token 
+        and returns True if there is one.
+        """
+        with self._login_lock:
+            if client.token == self.ost.token:
+                self.accounts.drop_token(self.current_account)
+                if self._use_account(self.current_account) is None:
+                    return False
+            client.token = self.ost.token
+        return True
+    
+    def _search_batch(self, imdb_ids, language = 'eng'):
+        """
+        Makes a single search call for a group of IMDB ID's and splits the 
+        results back out by ID. Returns a dictionary of ID, search results.
+        """
+        client = self._search_client()
+        queries = [{'imdbid':imdb_id, 'sublanguageid': language} for imdb_id in imdb_ids]
+        databased_search = client.search_subtitles(queries)
+        self.metrics.count('search_requests', account = self.current_account)
+        
+        # Try again if the server had a problem or the token expired
+        attempt = 0
+        logged_in = False
+        while databased_search is None:
+            status = _last_status(client)
+            if status.startswith('5') and attempt < self.retries:
+                # Server side problem, wait and search again
+                attempt += 1
+                self.ObjPrint(["Search failed with", status, "~ Trying again."])
+                time.sleep(self.retry_wait * attempt)
+            elif status.startswith('401') and not logged_in and self.current_account in self.accounts:
+                # The saved token may have expired, log in again once
+                logged_in = True
+                self.ObjPrint(["Search failed with", status, "~ Logging in again."])
+                if not self._search_login(client):
+                    break
+            else:
+                break
+            self.metrics.count('search_retries', status = status)
+            databased_search = client.search_subtitles(queries)
+            self.metrics.count('search_requests', account = self.current_account)
         
+        if databased_search is None:
+            self.ObjPrint(["Search failed with", _last_status(client), "~ Giving up on", imdb_ids])
+            self.metrics.count('search_failures', value = len(imdb_ids))
+        
+        if len(imdb_ids) == 1 or databased_search is None:
+            return dict((imdb_id, databased_search) for imdb_id in imdb_ids)
+        
+        # Results of a multi query search come back in one list
+        by_number = dict((int(str(imdb_id).replace('tt', '')), imdb_id) for imdb_id in imdb_ids)
+        results = dict((imdb_id, []) for imdb_id in imdb_ids)
+        for result in databased_search:
+            try:
+                imdb_id = by_number[int(result.get('IDMovieImdb'))]
+            except (KeyError, TypeError, ValueError):
+                continue
+            results[imdb_id].append(result)
+        return results
+    
+    def search_opensubtitles(self, imdb_ids, language = 'eng'):
+        """
+        Searches OpenSubtitles for each IMDB ID and returns a dictionary 
+        with IDs as keys and the list of search results as values.
+        
+        Up to search_workers searches are made at once with each one 
+        asking for search_batch_size ID's.
+        """
+        imdb_ids = list(imdb_ids)
+        if self.ost.token is None and len(self.accounts) > 0:
+            self.login()
+        size = max(1, self.search_batch_size)
+        batchs = [imdb_ids[i:i+size] for i in range(0, len(imdb_ids), size)]
+        
+        search_results = {}
+        with self.metrics.timer('search'):
+            self._search_all(batchs, language, search_results)
+        
+        return search_results
+    
+    def _search_all(self, batchs, language, search_results):
+        """ Runs the search batches, in a thread pool if more than one """
+        if self.search_workers > 1 and len(batchs) > 1:
+            workers = min(self.search_workers, len(batchs))
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                for batch_results in pool.map(lambda batch: self._search_batch(batch, language), batchs):
+                    search_results.update(batch_results)
+        else:
+            for batch in batchs:
+                search_results.update(self._search_batch(batch, language))
+        
+    def _resolve_subtitle_ids(self, imdb_ids, languages = None, ranking = None):
+        """
+        Searches for the subtitle file of each IMDB ID. Returns the list of 
+        IDSubtitleFile found, a dictionary mapping them back to IMDB ID's 
+        and the IMDB ID's whose search failed.
+        
+        :param languages Finds a file for each of these languages from a 
+            single search per IMDB ID. The files are then mapped back to 
+            (IMDB ID, language).
+        :param ranking A SubtitleRanking to choose between the results.
+        """
         id_subtitles = []
         id_refrence = {}
+        failed = []
+        wanted = ['eng'] if languages is None else list(languages)
+        
+        if self.dedup_index is not None and languages is None:
+            # Found to be near duplicates in an earlier download
+            imdb_ids = [imdb_id for imdb_id in imdb_ids if not self.dedup_index.is_duplicate(imdb_id)]
+        
+        def key(imdb_id, language):
+            return imdb_id if languages is None else (imdb_id, language)
+        
+        # Episodes with a known subtitle file don't need searching again
+        to_search = []
+        cached = set()
+        for imdb_id in imdb_ids:
+            missing = False
+            for language in wanted:
+                id_subtitle = self.cache.get_sub_id(imdb_id, language) if self.cache is not None else None
+                if id_subtitle is None:
+                    missing = True
+                else:
+                    id_subtitles+= [id_subtitle]
+                    id_refrence[id_subtitle] = key(imdb_id, language)
+                    cached.add(key(imdb_id, language))
+            if missing:
+                to_search.append(imdb_id)
         
         # Get the subtitles of all of the episodes in the imdb_ids list
         self.ObjPrint("Search for subtitles of all episodes.")
-        for imdb_id in imdb_ids:
-            databased_search = self.ost.search_subtitles([{'imdbid':imdb_id, 'sublanguageid': 'eng'}])
-            try:
-                id_subtitle = databased_search[0].get('IDSubtitleFile')
-                id_subtitles+= [id_subtitle]
-                id_refrence[id_subtitle] = imdb_id
-            except IndexError:
-                print("Couldn't find any search results for this episode, ",
+        search_results = self.search_opensubtitles(to_search, language = ",".join(wanted))
+        for imdb_id in to_search:
+            databased_search = search_results[imdb_id]
+            if databased_search is None:
+                print("The search failed for this episode, ",
                       imdb_id, " ~ Will not be downloaded.")
+                failed.append(imdb_id)
+                continue
+            if languages is None and ranking is None:
+                chosen = {'eng': databased_search[0]} if len(databased_search) > 0 else {}
+            else:
+                chosen = choose_subtitles(databased_search, wanted, ranking)
+            for language in wanted:
+                if key(imdb_id, language) in cached:
+                    continue
+                if language not in chosen:
+                    print("Couldn't find any search results for this episode, ",
+                          imdb_id, language, " ~ Will not be downloaded.")
+                    continue
+                id_subtitle = chosen[language].get('IDSubtitleFile')
+                id_subtitles+= [id_subtitle]
+                id_refrence[id_subtitle] = key(imdb_id, language)
+                if self.cache is not None:
+                    self.cache.set_sub_id(imdb_id, id_subtitle, language)
         
-        all_subtitles = {}
+        return id_subtitles, id_refrence, failed
+    
+    def _download_batch(self, ids, raw = False):
+        """
+        Makes one download call. Returns a dictionary of IDSubtitleFile, 
+        SRT or None if the download failed.
         
-        # We will group ID into batches of 18 to make the call.
+        :param raw Returns the gzipped SRT bytes sent by OpenSubtitles 
+            instead. The client is skipped so the data is only base64 
+            decoded, not unzipped and decoded to text.
+        """
+        if not raw:
+            return self.ost.download_subtitles(ids, return_decoded_data=True)
+        
+        self.ost.data = self.ost.xmlrpc.DownloadSubtitles(self.ost.token, ids)
+        if not _last_status(self.ost).startswith('200'):
+            return None
+        encoded_data = self.ost.data.get('data')
+        if not encoded_data:
+            return None
+        return dict((item['idsubtitlefile'], base64.b64decode(item['data'])) for item in encoded_data)
+    
+    def _iter_batches(self, id_subtitles, raw = False):
+        """
+        Downloads subtitle files in batches. Yields the list of 
+        IDSubtitleFile in each batch with a dictionary of their SRT, or 
+        of gzipped SRT bytes if raw.
+        Anything in the cache is yielded first, in batches of 
+        download_batch_size read only as each is yielded.
+        """
+        
+        # Anything already in the cache is returned without downloading
+        if self.cache is not None:
+            to_download = [id_ for id_ in id_subtitles if id_ not in self.cache]
+            in_cache = [id_ for id_ in id_subtitles if id_ in self.cache]
+            loaded = 0
+            for start in range(0, len(in_cache), self.download_batch_size):
+                cached = {}
+                for id_ in in_cache[start:start+self.download_batch_size]:
+                    srt = self.cache.get(id_)
+                    if srt is None:
+                        # The file went missing, so download it instead
+                        to_download.append(id_)
+                    else:
+                        cached[id_] = gzip.compress(srt.encode("utf-8")) if raw else srt
+                loaded += len(cached)
+                self.metrics.count('cache_hits', len(cached))
+                if len(cached) > 0:
+                    yield list(cached), cached
+                del cached
+            self.cache.save()
+            self.ObjPrint(["Loaded", loaded, "subtitles from cache"])
+            id_subtitles = to_download
+        
+        # We will group ID into batches to make the call. Each batch is 
+        # sized to fit the downloads left on the account sending it.
         
         self.ObjPrint("Starting subtitle downloads.")
-        batchs = []
-        mini_list = []
-        for an_id in id_subtitles:
-            if len(mini_list)<19:
-                mini_list+=[an_id]
-            else:
-                batchs+=[mini_list]
-                mini_list = []
-        if len(mini_list)>0:
-            batchs+=[mini_list]
-                
-        for mini_list in batchs:
-                srt_dict = self.ost.download_subtitles(mini_list, return_decoded_data=True)
+        start = 0
+        retried = False
+        server_errors = 0
+        while start < len(id_subtitles):
+                size = self._prepare_account()
+                mini_list = id_subtitles[start:start+size]
+                with self.metrics.timer('download'):
+                    srt_dict = self._download_batch(mini_list, raw)
+                self.metrics.count('download_requests', account = self.current_account)
 
                 # Check that the download worked
    
-                while srt_dict is None:
-                    print("OpenSubtitles returned nothing, possibly due to rate limit",
-                          "Attempting to login via a new user")
-
-                    fix_result = self.rate_limit_naughty_fix()
-                    
-                    if fix_result == -1:
+                if srt_dict is None:
+                    status = _last_status(self.ost)
+                    if status.startswith('200'):
+                        # Nothing came back, e.g. the files were removed from the site
+                        srt_dict = {}
+                if srt_dict is None:
+                    self.metrics.count('download_failures', status = status,
+                                       account = self.current_account)
+                    if status.startswith('5'):
+                        # Server side problem, wait and send the batch again
+                        if server_errors >= self.retries:
+                            raise Exception("OpenSubtitles download failed with " + status)
+                        server_errors += 1
+                        self.metrics.count('download_retries', reason = 'server')
+                        self.ObjPrint(["Download failed with", status, "~ Trying again."])
+                        time.sleep(self.retry_wait * server_errors)
+                        continue
+                    if len(self.accounts) == 0:
                         raise Exception("Account Access Failed")
-
-                    srt_dict = self.ost.download_subtitles(mini_list, return_decoded_data=True)
-
-
-                for id_ in mini_list:           
-                    all_subtitles[id_]= srt_dict[id_]
+                    if not status.startswith('407'):
+                        if retried:
+                            raise Exception("OpenSubtitles download failed with " + status)
+                        # The saved token may have expired, log in again once
+                        self.accounts.drop_token(self.current_account)
+                        self.metrics.count('download_retries', reason = 'login')
+                        retried = True
+                        continue
+                    print("OpenSubtitles download limit reached,",
+                          "Attempting to login via a new user")
+                    self.metrics.count('rate_limited', account = self.current_account)
+                    self.accounts.mark_exhausted(self.current_account)
+                    retried = False
+                    continue
+                
+                retried = False
+                server_errors = 0
+                start += len(mini_list)
+                if self.current_account is not None and self.current_account in self.accounts:
+                    self.accounts.record(self.current_account, len(mini_list))
+                
+                if self.metrics.enabled:
+                    self.metrics.observe('batch_size', len(mini_list))
+                    self.metrics.count('subtitles_downloaded', len(srt_dict), account = self.current_account)
+                    self.metrics.count('bytes_downloaded', sum(len(srt) if raw else len(srt.encode("utf-8"))
+                                                               for srt in srt_dict.values()))
+                
+                missing = [id_ for id_ in mini_list if id_ not in srt_dict]
+                if len(missing) > 0:
+                    print("OpenSubtitles didn't return", missing, " ~ Will not be saved.")
+                    mini_list = [id_ for id_ in mini_list if id_ in srt_dict]
                 
                 self.ObjPrint(["Downloaded SRT for all", mini_list])
                 
+                # Raw data would need unzipping to be cached
+                if self.cache is not None and not raw:
+                    for id_ in mini_list:
+                        self.cache.put(id_, srt_dict[id_])
+                    self.cache.save()
+                
+                yield mini_list, srt_dict
+                
+                del srt_dict
         
         self.ObjPrint("Finished Downloading")
-        # Match the resulted subtitle id to imdb ids for returning
-        returnable_dict = {}
-        for sub_id, subtitles in all_subtitles.items():
-            returnable_dict[id_refrence[sub_id]] = subtitles
-            
+    
+    def _prepare_save(self, new_data_path = None):
+        """ Sets and creates the folder that files are saved in """
+        if new_data_path is not None:
+            self.data_path = new_data_path
+        if not os.path.exists(self.data_path):
+            os.makedirs(self.data_path)
+    
+    def iter_download(self, imdb_ids, save = False, new_data_path = None, raw = False,
+                      languages = None, ranking = None):
+        """
+        Generator version of download_opensubtitles. Yields (IMDB ID, SRT) 
+        pairs as each batch of downloads comes back so only one batch is 
+        held in memory at a time.
+        
+        :param save will write each SRT to the data path as it arrives.
+        :param raw yields the gzipped SRT bytes from OpenSubtitles as they 
+            are, which save writes to <imdb_id>.srt.gz
+        :param languages The SubLanguageID's to download, e.g. ['eng', 'fre']. 
+            Every language is found from one search per IMDB ID and all 
+            of the files share download batches. (IMDB ID, language) is 
+            yielded in place of the IMDB ID and save writes 
+            <imdb_id>.<language>.srt
+        :param ranking A ranking.SubtitleRanking choosing between the 
+            search results, by default the first of each language is used.
+        """
+        id_subtitles, id_refrence, failed = self._resolve_subtitle_ids(
+            imdb_ids, languages = languages, ranking = ranking)
+        
+        if save:
+            self._prepare_save(new_data_path)
+        
+        for mini_list, srt_dict in self._iter_batches(id_subtitles, raw = raw):
+            # Match the resulted subtitle id to imdb ids for returning
+            for id_ in mini_list:
+                imdb_id = id_refrence[id_]
+                name = imdb_id if languages is None else "%s.%s" % imdb_id
+                if self.dedup_index is not None and self._is_near_duplicate(name, srt_dict[id_], raw):
+                    continue
+                if save:
+                    self.save_srt(name, srt_dict[id_])
+                yield imdb_id, srt_dict[id_]
+            if self.dedup_index is not None and self.dedup_index.path is not None:
+                self.dedup_index.save()
+    
+    def iter_series_download(self, series, save = False, new_data_path = None, workers = 4,
+                             raw = False):
+        """
+        Yields (IMDB ID, SRT) for every episode of a series, downloading 
+        each season as soon as IMDB returns it while later seasons are 
+        still being fetched.
+        
+        :param series A series from find or find_from_id_tv_show, best 
+            found with fetch_episodes = False.
+        :param workers The number of seasons fetched from IMDB at once.
+        """
+        for season, episodes in self.iter_seasons(series, workers = workers):
+            # Labels such as 'unknown' go after the numbered episodes
+            order = sorted(episodes, key = lambda episode: (not isinstance(episode, int), str(episode).zfill(5)))
+            imdb_ids = [episodes[episode].movieID for episode in order]
+            self.ObjPrint(["Season", season, "has", len(imdb_ids), "episodes"])
+            for imdb_id, srt in self.iter_download(imdb_ids, save = save,
+                                                   new_data_path = new_data_path, raw = raw):
+                yield imdb_id, srt
+    
+    def download_job(self, imdb_ids, manifest_path = None, new_data_path = None, raw = False):
+        """
+        Downloads and saves the subtitles of many IMDB ID's while keeping a 
+        manifest of how far each one got. The manifest is written after the 
+        search and after every batch, so running again with the same 
+        manifest picks up from the first batch that wasn't finished.
+        
+        :param manifest_path The JSON manifest file. Defaults to 
+            job_manifest.json in the data path.
+        :param raw saves the gzipped data from OpenSubtitles as 
+            <imdb_id>.srt.gz without decoding it.
+        
+        Returns the DownloadJob. Subtitles are only saved to file, not 
+        returned. With a dedup index set, near duplicates are not saved 
+        and are left in the DUPLICATE state.
+        """
+        self._prepare_save(new_data_path)
+        if manifest_path is None:
+            manifest_path = self.data_path+"job_manifest.json"
+        
+        job = DownloadJob(manifest_path)
+        job.add(imdb_ids)
+        
+        # Search for anything not searched in an earlier run
+        to_search = job.with_state(PENDING)
+        if self.dedup_index is not None:
+            # Found to be near duplicates in an earlier download
+            for imdb_id in to_search:
+                if self.dedup_index.is_duplicate(imdb_id):
+                    job.set_state(imdb_id, DUPLICATE)
+            to_search = job.with_state(PENDING)
+        if len(to_search) > 0:
+            id_subtitles, id_refrence, failed = self._resolve_subtitle_ids(to_search)
+            for imdb_id in to_search:
+                # Failed searches stay pending for the next run
+                if imdb_id not in failed:
+                    job.set_state(imdb_id, SEARCHED)
+            for id_, imdb_id in id_refrence.items():
+                job.set_state(imdb_id, RESOLVED, sub_id = id_)
+            job.save()
+        
+        # Download everything resolved but not yet saved
+        id_refrence = {}
+        for imdb_id in job.with_state(RESOLVED, DOWNLOADED):
+            id_refrence[job.sub_id(imdb_id)] = imdb_id
+        self.ObjPrint(["Job has", len(id_refrence), "subtitles left to download"], important = True)
+        
+        for mini_list, srt_dict in self._iter_batches(list(id_refrence), raw = raw):
+            for id_ in mini_list:
+                job.set_state(id_refrence[id_], DOWNLOADED)
+            for id_ in mini_list:
+                imdb_id = id_refrence[id_]
+                if self.dedup_index is not None and self._is_near_duplicate(imdb_id, srt_dict[id_], raw):
+                    job.set_state(imdb_id, DUPLICATE)
+                elif self.save_srt(imdb_id, srt_dict[id_]):
+                    job.set_state(imdb_id, SAVED)
+            if self.dedup_index is not None and self.dedup_index.path is not None:
+                self.dedup_index.save()
+            job.save()
+        
+        # Every batch was sent, so anything still resolved came back empty
+        for imdb_id in job.with_state(RESOLVED):
+            job.set_state(imdb_id, MISSING)
+        job.save()
+        
+        self.ObjPrint(["Job finished with", job.summary()], important = True)
+        return job
+    
+    def download_opensubtitles(self, imdb_ids, save = False, new_data_path = None, raw = False,
+                               languages = None, ranking = None):
+        """
+        Takes some IMDB ID's and downloads the first english subtitle 
+        search results as SRT files.
+        
+        Ideally this function takes all the episode ID's. This allows 
+        the program to collect the subtitles 
+        in bunches to avoid hitting rate limits. Each call can make 
+        20 requests for subtitles in one.
+        
+        :param raw returns gzipped SRT bytes and saves <imdb_id>.srt.gz 
+            files, skipping the decoding. load_from_file reads them.
+        :param languages Downloads each of these languages, keyed by 
+            (IMDB ID, language). See iter_download.
+        :param ranking A ranking.SubtitleRanking for choosing the files.
+        """
         if save:
             self.ObjPrint("Saving Files")
-            if new_data_path is not None:
-                self.data_path = new_data_path
-            try:
-                if not os.path.exists(self.data_path):
-                    os.makedirs(self.data_path)
-                for imdb_id, subtitle in returnable_dict.items():
-                    with open(self.data_path+imdb_id+".srt", "w+") as f:
-                        f.write(subtitle)
-                self.ObjPrint("Saved all to file")
-            except:
-                self.ObjPrint("Somethign went wrong during saving")
+        
+        returnable_dict = dict(self.iter_download(imdb_ids, save = save,
+                                                  new_data_path = new_data_path, raw = raw,
+                                                  languages = languages, ranking = ranking))
+        
+        if save:
+            self.ObjPrint("Saved all to file")
             
         return returnable_dict
     
+    def save_srt(self, imdb_id, subtitle):
+        """
+        Saves a single SRT to the data path as <imdb_id>.srt, or gzipped 
+        SRT bytes from a raw download as <imdb_id>.srt.gz
+        Returns False if the file couldn't be written.
+        """
+        try:
+            with self.metrics.timer('save'):
+                if isinstance(subtitle, bytes):
+                    with open(self.data_path+str(imdb_id)+".srt.gz", "wb") as f:
+                        f.write(subtitle)
+                else:
+                    with open(self.data_path+str(imdb_id)+".srt", "w+") as f:
+                        f.write(subtitle)
+        except OSError:
+            self.ObjPrint(["Somethign went wrong saving", imdb_id], important = True)
+            self.metrics.count('save_failures')
+            return False
+        return True
+    
     def ObjPrint(self, obj, important = False):
         if self.verbose > 2:
             print(obj)
@@ -307,22 +997,56 @@ class SubDownloader(object):
                 print(obj)
         
                 
-    def save_meta_data(self, meta_data_obj, new_data_path = None):
+    def save_meta_data(self, meta_data_obj, new_data_path = None, series_id = None):
         """
-        Saves the metadata object of the episodes to file as a pickle.
+        Adds the metadata of the episodes to the metadata store, meta.db in 
+        the data path, replacing any episodes already there. A 
+        meta_object.pickle from older versions is imported the first time.
+        
+        :param meta_data_obj A list from get_episode_metas, an EpisodeTable 
+            or a series object from find.
+        :param series_id The IMDB ID of the series, so it can be loaded 
+            on its own with load_meta_data. Defaults to the ID of a 
+            series object.
         """
         if new_data_path is not None:
             self.data_path = new_data_path
+        
+        if hasattr(meta_data_obj, 'movieID'):
+            # A series object rather than a list of metadata
+            if series_id is None:
+                series_id = meta_data_obj.movieID
+            if 'episodes' not in meta_data_obj:
+                meta_data_obj = self._update_episodes(meta_data_obj)
+            meta_data_obj = EpisodeTable.from_series(meta_data_obj)
             
         try:
-            if not os.path.exists(self.data_path):
-                os.makedirs(self.data_path)
-           
-            with open(self.data_path+"meta_object.pickle", "wb+") as f:
-                pickle.dump(meta_data_obj, f)
-                print("File has been saved")
-        except:
-            self.ObjPrint("Somethign went wrong during saving")
+            store = self._meta_store()
+            store.add(meta_data_obj, series_id = series_id)
+            store.close()
+            print("File has been saved")
+        except (sqlite3.Error, OSError, KeyError, TypeError, ValueError) as e:
+            print("Something went wrong during saving ~", repr(e))
+    
+    def load_meta_data(self, series_id = None, season = None):
+        """
+        Returns the stored metadata of a series, or one season of it, as a 
+        list of get_episode_metas dictionaries.
+        """
+        store = self._meta_store()
+        meta_list = store.series(series_id, season)
+        store.close()
+        return meta_list
+    
+    def _meta_store(self):
+        """ Opens the metadata store in the data path """
+        if not os.path.exists(self.data_path):
+            os.makedirs(self.data_path)
+        store = MetaStore(self.data_path+"meta.db")
+        old_file = self.data_path+"meta_object.pickle"
+        if len(store) == 0 and os.path.exists(old_file):
+            store.import_pickle(old_file)
+        return store
         
         
         
@@ -0,0 +1,164 @@
+import json
+import os
+import time
+
+
+# OpenSubtitles lets a normal account download 200 subtitles every 24 hours
+DEFAULT_QUOTA = 200
+QUOTA_PERIOD = 24*60*60
+# Tokens expire after 15 minutes without use
+TOKEN_TTL = 15*60
+
+
+class AccountPool(object):
+    """
+    Keeps track of the OpenSubtitles accounts that can be used for
+    downloading, how many downloads each has left and the token
+    of their last login.
+
+    Each account's download window starts with its first download and
+    resets QUOTA_PERIOD seconds later. If a path is given the usage and
+    tokens are saved there so they survive restarts. Passwords are never
+    written to disk and need to be added again with add.
+    """
+
+    def __init__(self, path = None, quota = DEFAULT_QUOTA):
+        """
+        :param path A JSON file to keep the pool state in.
+        :param quota The default number of downloads per account per period.
+        """
+        self.path = path
+        self.quota = quota
+        self.passwords = {}  # username -> password, in the order added
+        self.state = {}  # username -> usage and token information
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.state = json.load(f)
+
+
+    def save(self):
+        """ Writes the usage of every account to the pool file """
+        if self.path is None:
+            return
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_file, self.path)
+
+    def _account(self, username):
+        if username not in self.state:
+            self.state[username] = {'quota': self.quota, 'used': 0, 'reset_at': None,
+                                    'token': None, 'token_time': 0}
+        return self.state[username]
+
+
+    def add(self, username, password, quota = None):
+        """ Adds an account. Returns False if it was already in the pool """
+        if username in self.passwords and self.passwords[username] == password:
+            return False
+        self.passwords[username] = password
+        account = self._account(username)
+        if quota is not None:
+            account['quota'] = quota
+        return True
+
+    def remove(self, username):
+        """ Removes an account from the pool """
+        self.passwords.pop(username, None)
+        self.state.pop(username, None)
+
+    def __contains__(self, username):
+        return username in self.passwords
+
+    def __len__(self):
+        return len(self.passwords)
+
+    def credentials(self):
+        """ Returns a list of (username, password) in the order added """
+        return list(self.passwords.items())
+
+
+    def remaining(self, username):
+        """ Returns the number of downloads an account has left """
+        account = self._account(username)
+        if account['reset_at'] is not None and time.time() >= account['reset_at']:
+            account['used'] = 0
+            account['reset_at'] = None
+        return max(0, account['quota'] - account['used'])
+
+    def best(self):
+        """
+        Returns the username with the most downloads left, or None if
+        every account has run out.
+        """
+        best_user = None
+        best_left = 0
+        for username in self.passwords:
+            left = self.remaining(username)
+            if left > best_left:
+                best_user, best_left = username, left
+        return best_user
+
+    def exhausted(self):
+        """ Returns the usernames that have no downloads left """
+        return [username for username in self.passwords if self.remaining(username) == 0]
+
+    def next_reset(self):
+        """ Returns the time the first exhausted account resets, or None """
+        resets = [self.state[username]['reset_at'] for username in self.exhausted()
+                  if self.state[username]['reset_at'] is not None]
+        if len(resets) == 0:
+            return None
+        return min(resets)
+
+
+    def record(self, username, count):
+        """ Counts downloads against an account """
+        account = self._account(username)
+        self.remaining(username)
+        if account['reset_at'] is None:
+            account['reset_at'] = time.time() + QUOTA_PERIOD
+        account['used'] += count
+        account['token_time'] = time.time()
+        self.save()
+
+    def mark_exhausted(self, username):
+        """
+        Marks an account as having no downloads left, used when
+        OpenSubtitles refuses a download.
+        """
+        account = self._account(username)
+        account['used'] = account['quota']
+        if account['reset_at'] is None:
+            account['reset_at'] = time.time() + QUOTA_PERIOD
+        self.save()
+
+    def reset(self, username = None):
+        """ Forgets the usage of one account, or every account """
+        usernames = [username] if username is not None else list(self.state)
+        for name in usernames:
+            account = self._account(name)
+            account['used'] = 0
+            account['reset_at'] = None
+        self.save()
+
+
+    def get_token(self, username):
+        """ Returns the last token for an account if it is still valid """
+        account = self._account(username)
+        if account['token'] is not None and time.time() - account['token_time'] < TOKEN_TTL:
+            return account['token']
+        return None
+
+    def set_token(self, username, token):
+        """ Stores the token from logging in to an account """
+        account = self._account(username)
+        account['token'] = token
+        account['token_time'] = time.time()
+        self.save()
+
+    def drop_token(self, username):
+        """ Forgets the token of an account so the next use logs in again """
+        self._account(username)['token'] = None
+        self.save()
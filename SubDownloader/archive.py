@@ -0,0 +1,222 @@
+from bisect import bisect_left, bisect_right
+import json
+import mmap
+import os
+import zlib
+
+import SubDownloader.utils as utl
+
+
+class SubtitleArchive(object):
+    """
+    Read only access to a packed subtitle archive.
+
+    An archive is a single <path>.dat file holding every subtitle one
+    after another, optionally zlib compressed, and a <path>.idx JSON
+    index of where each IMDB ID starts. The data file is memory mapped,
+    so reading a subtitle is a slice of the map rather than a file open.
+    """
+
+    def __init__(self, path):
+        """
+        :param path The archive path without the .dat/.idx extension.
+        """
+        self.path = path
+        self.entries = _read_index(path)  # imdb_id -> [offset, length, compressed]
+        self.ids = sorted(self.entries)
+
+        self._file = open(path + ".dat", "rb")
+        if os.path.getsize(path + ".dat") > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self._map = b""
+
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def get(self, imdb_id, default = None):
+        """ Returns the SRT of an IMDB ID, or default if it isn't in the archive """
+        entry = self.entries.get(str(imdb_id))
+        if entry is None:
+            return default
+        offset, length, compressed = entry
+        data = self._map[offset:offset+length]
+        if compressed:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def __getitem__(self, imdb_id):
+        srt = self.get(imdb_id)
+        if srt is None:
+            raise KeyError(imdb_id)
+        return srt
+
+    def __contains__(self, imdb_id):
+        return str(imdb_id) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def keys(self):
+        """ Returns the IMDB ID's in sorted order """
+        return list(self.ids)
+
+    def items(self):
+        """ Lazily yields (IMDB ID, SRT) in ID order """
+        for imdb_id in self.ids:
+            yield imdb_id, self.get(imdb_id)
+
+    def range(self, start = None, end = None):
+        """
+        Lazily yields (IMDB ID, SRT) for every ID from start up to and
+        including end, compared as strings.
+        """
+        first = 0 if start is None else bisect_left(self.ids, str(start))
+        last = len(self.ids) if end is None else bisect_right(self.ids, str(end))
+        for imdb_id in self.ids[first:last]:
+            yield imdb_id, self.get(imdb_id)
+
+    def load(self, ids):
+        """
+        Takes an array of ids or a single id and returns the SRT's in a
+        dictionary with IDs as keys, like load_from_file.
+        """
+        if type(ids) is int or type(ids) is str:
+            return {ids: self[ids]}
+        all_data = []
+        for this_id in ids:
+            srt = self.get(this_id)
+            if srt is None:
+                print("There wasn't a file for ", this_id)
+            else:
+                all_data.append((this_id, srt))
+        return dict(all_data)
+
+
+class ArchiveWriter(object):
+    """
+    Adds subtitles to a packed archive, creating it if needed.
+
+    New subtitles are appended to the data file and the index is written
+    when the writer is closed. Adding an ID that is already in the
+    archive replaces it.
+    """
+
+    def __init__(self, path, compress = True):
+        """
+        :param path The archive path without the .dat/.idx extension.
+        :param compress zlib compresses each subtitle on its own.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.compress = compress
+        self.entries = _read_index(path) if os.path.exists(path + ".idx") else {}
+        self._file = open(path + ".dat", "ab")
+        self._offset = self._file.tell()
+
+    def add(self, imdb_id, srt):
+        """ Appends the SRT of an IMDB ID """
+        data = srt.encode("utf-8")
+        if self.compress:
+            data = zlib.compress(data)
+        self._file.write(data)
+        self.entries[str(imdb_id)] = [self._offset, len(data), self.compress]
+        self._offset += len(data)
+
+    def add_all(self, srt_items):
+        """ Appends every (IMDB ID, SRT) pair, e.g. from iter_download """
+        for imdb_id, srt in srt_items:
+            self.add(imdb_id, srt)
+
+    def close(self):
+        """ Flushes the data and writes the index """
+        self._file.close()
+        temp_file = self.path + ".idx.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({'entries': self.entries}, f)
+        os.replace(temp_file, self.path + ".idx")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_index(path):
+    with open(path + ".idx", "r") as f:
+        return json.load(f)['entries']
+
+
+def archive_from_directory(data_path, archive_path, ids = None, compress = True):
+    """
+    Packs the <id>.srt and <id>.srt.gz files in a data path into an archive.
+
+    :param ids The ID's to pack. Defaults to every .srt or .srt.gz file found.
+    Returns the number of subtitles packed.
+    """
+    if ids is None:
+        folder = os.path.dirname(data_path) or "."
+        prefix = os.path.basename(data_path)
+        ids = []
+        for name in sorted(os.listdir(folder)):
+            if not name.startswith(prefix):
+                continue
+            if name.endswith(".srt"):
+                this_id = name[len(prefix):-4]
+            elif name.endswith(".srt.gz"):
+                this_id = name[len(prefix):-7]
+            else:
+                continue
+            if this_id not in ids:
+                ids.append(this_id)
+
+    count = 0
+    with ArchiveWriter(archive_path, compress = compress) as writer:
+        for this_id in ids:
+            try:
+                writer.add(this_id, utl._read_srt_file(data_path, this_id))
+                count += 1
+            except FileNotFoundError:
+                print("There wasn't a file for ", this_id)
+    return count
+
+
+def archive_to_directory(archive_path, data_path, ids = None):
+    """
+    Unpacks an archive into <id>.srt files in a data path.
+
+    :param ids The ID's to unpack. Defaults to the whole archive.
+    Returns the number of files written.
+    """
+    folder = os.path.dirname(data_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    count = 0
+    with SubtitleArchive(archive_path) as archive:
+        for this_id in (archive.keys() if ids is None else ids):
+            srt = archive.get(this_id)
+            if srt is None:
+                print("There wasn't a file for ", this_id)
+                continue
+            with open(data_path+str(this_id)+".srt", "w+") as f:
+                f.write(srt)
+            count += 1
+    return count
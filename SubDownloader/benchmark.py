@@ -0,0 +1,263 @@
+"""
+Offline benchmarks for SubDownloader.
+
+Builds synthetic subtitle files so nothing needs downloading, and runs the
+download scenario against mock_server. Run with
+
+    python -m SubDownloader.benchmark --output results.json
+
+and compare the JSON between versions to catch regressions.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import SubDownloader.utils as utl
+
+
+VOCAB = ["the", "you", "i", "to", "a", "it", "that", "what", "is", "we", "know",
+         "don't", "here", "no", "he", "have", "just", "this", "winter", "is",
+         "coming", "king", "lord", "dragon", "night", "watch", "brother", "gold",
+         "Sam", "Jon", "Where", "When", "Why", "okay", "yeah", "hey", "come", "on"]
+
+
+def _timestamp(ms):
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return "%02d:%02d:%02d,%03d" % (hours, minutes, seconds, ms)
+
+
+def synthetic_srt(n_cues = 1000, seed = 0):
+    """
+    Returns an SRT file as a string with n_cues cues of random dialogue,
+    including the odd formatting tag.
+    """
+    rand = random.Random(seed)
+    cues = []
+    start = 1000
+    for i in range(1, n_cues+1):
+        end = start + rand.randint(800, 4000)
+        lines = []
+        for _ in range(rand.randint(1, 2)):
+            words = [rand.choice(VOCAB) for _ in range(rand.randint(2, 9))]
+            line = " ".join(words).capitalize() + rand.choice([".", "?", "!", "..."])
+            if rand.random() < 0.1:
+                line = "<i>" + line + "</i>"
+            lines.append(line)
+        cues.append("%d\n%s --> %s\n%s\n" % (i, _timestamp(start), _timestamp(end), "\n".join(lines)))
+        start = end + rand.randint(100, 2000)
+    return "\n".join(cues)
+
+
+def synthetic_microdvd(n_cues = 1000, seed = 0):
+    """ Returns a MicroDVD subtitle as a string with n_cues lines """
+    rand = random.Random(seed)
+    lines = []
+    frame = 24
+    for _ in range(n_cues):
+        end = frame + rand.randint(20, 100)
+        text = "|".join(" ".join(rand.choice(VOCAB) for _ in range(rand.randint(2, 8)))
+                        for _ in range(rand.randint(1, 2)))
+        lines.append("{%d}{%d}%s" % (frame, end, text))
+        frame = end + rand.randint(2, 50)
+    return "\n".join(lines)
+
+
+def synthetic_corpus(n_files = 50, n_cues = 700, microdvd_share = 0.1, seed = 0):
+    """
+    Returns a dictionary of fake IMDB ID, subtitle string. About
+    microdvd_share of the files are MicroDVD, the rest SRT.
+    """
+    rand = random.Random(seed)
+    corpus = {}
+    for i in range(n_files):
+        imdb_id = "%07d" % (9000000 + i)
+        if rand.random() < microdvd_share:
+            corpus[imdb_id] = synthetic_microdvd(n_cues, seed = seed + i)
+        else:
+            corpus[imdb_id] = synthetic_srt(n_cues, seed = seed + i)
+    return corpus
+
+
+def _best_time(func, repeat = 3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        taken = time.perf_counter() - start
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+def bench_process_srt(corpus, repeat = 3):
+    """
+    Times process_srt over every file in the corpus, both from strings
+    and from open file objects. Returns the throughput in MB/s.
+    """
+    texts = list(corpus.values())
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+
+    from_strings = _best_time(lambda: [utl.process_srt(text) for text in texts], repeat)
+    from_files = _best_time(lambda: [utl.process_srt(io.StringIO(text)) for text in texts], repeat)
+
+    return {'seconds': from_strings,
+            'megabytes': megabytes,
+            'string_mb_per_s': megabytes / from_strings,
+            'stream_mb_per_s': megabytes / from_files}
+
+
+def bench_compress(token_lists, repeat = 3):
+    """ Times _compress over every token list """
+    n_tokens = sum(len(tokens) for tokens in token_lists)
+    seconds = _best_time(lambda: [utl._compress(tokens) for tokens in token_lists], repeat)
+    return {'seconds': seconds, 'tokens': n_tokens, 'tokens_per_s': n_tokens / seconds}
+
+
+def bench_hhat(token_lists, method, max_tokens = None, repeat = 1):
+    """
+    Times _hhat with one method over every token list, cut to max_tokens
+    since the slower methods grow faster than linearly.
+    """
+    if max_tokens is not None:
+        token_lists = [tokens[:max_tokens] for tokens in token_lists]
+    n_tokens = sum(len(tokens) for tokens in token_lists)
+    seconds = _best_time(lambda: [utl._hhat(tokens, method = method) for tokens in token_lists], repeat)
+    return {'seconds': seconds, 'tokens': n_tokens, 'tokens_per_s': n_tokens / seconds,
+            'max_tokens': max_tokens}
+
+
+def bench_paired_compression(token_lists, repeat = 3):
+    """ Times normalised_paired_compression between each neighbouring pair """
+    pairs = list(zip(token_lists, token_lists[1:]))
+    seconds = _best_time(lambda: [utl.normalised_paired_compression(a, b) for a, b in pairs], repeat)
+    return {'seconds': seconds, 'pairs': len(pairs), 'pairs_per_s': len(pairs) / seconds}
+
+
+def bench_load_from_file(corpus, repeat = 3):
+    """ Writes the corpus to a temporary folder and times load_from_file """
+    folder = tempfile.mkdtemp()
+    try:
+        data_path = folder + os.sep
+        for imdb_id, srt in corpus.items():
+            with open(data_path+imdb_id+".srt", "w") as f:
+                f.write(srt)
+        ids = list(corpus)
+        seconds = _best_time(lambda: utl.load_from_file(ids, data_path = data_path), repeat)
+    finally:
+        shutil.rmtree(folder)
+    return {'seconds': seconds, 'files': len(ids), 'files_per_s': len(ids) / seconds}
+
+
+def bench_download(corpus, repeat = 1, server_args = None, **downloader_args):
+    """
+    Times the whole download_opensubtitles flow, search and download,
+    against a local mock_server. Needs imdbpy and python-opensubtitles.
+
+    :param server_args Options for the MockServer such as latency.
+    """
+    from SubDownloader.SubDownloader import SubDownloader
+    from SubDownloader.mock_server import MockIMDb, MockServer, catalogue_from_corpus
+
+    ids = list(corpus)
+    with MockServer(catalogue_from_corpus(corpus), **(server_args or {})) as server:
+        sd = SubDownloader(server_url = server.url, verbose = 0, ia = MockIMDb.from_corpus(corpus),
+                           **downloader_args)
+        # The mock server has no quota, so give the account enough for every run
+        sd.add_login("benchmark", "benchmark", quota = len(ids) * repeat)
+        sd.login()
+        seconds = _best_time(lambda: sd.download_opensubtitles(ids), repeat)
+    return {'seconds': seconds, 'ids': len(ids), 'ids_per_s': len(ids) / seconds}
+
+
+def bench_seasons(corpus, workers = 4, latency = 0.05, repeat = 1):
+    """
+    Times finding a series from a search and fetching its episodes with
+    iter_seasons, against a MockIMDb taking latency seconds a call.
+    Needs imdbpy and python-opensubtitles.
+    """
+    from SubDownloader.SubDownloader import SubDownloader
+    from SubDownloader.mock_server import MockIMDb
+
+    def fetch():
+        sd = SubDownloader(verbose = 0, ia = MockIMDb.from_corpus(corpus, latency = latency))
+        series = sd.find("Mock Series", force_series = True, fetch_episodes = False)
+        return list(sd.iter_seasons(series, workers = workers))
+
+    seconds = _best_time(fetch, repeat)
+    return {'seconds': seconds, 'episodes': len(corpus), 'workers': workers}
+
+
+def run_all(scale = 1.0, repeat = 3):
+    """
+    Runs every scenario on a synthetic corpus. scale changes the number of
+    files. Returns a dictionary of scenario name to its timings.
+    """
+    n_files = max(2, int(50 * scale))
+    corpus = synthetic_corpus(n_files = n_files)
+    token_lists = [utl.process_srt(srt) for srt in corpus.values()]
+
+    scenarios = [
+        ('process_srt', lambda: bench_process_srt(corpus, repeat)),
+        ('compress', lambda: bench_compress(token_lists, repeat)),
+        ('hhat_lewisbagrow', lambda: bench_hhat(token_lists[:5], 'lewisbagrow', max_tokens = 2000)),
+        ('hhat_fastlookup', lambda: bench_hhat(token_lists[:5], 'fastlookup', max_tokens = 2000)),
+        ('hhat_suffixautomaton', lambda: bench_hhat(token_lists, 'suffixautomaton')),
+        ('normalised_paired_compression', lambda: bench_paired_compression(token_lists, repeat)),
+        ('load_from_file', lambda: bench_load_from_file(corpus, repeat)),
+        ('download_opensubtitles', lambda: bench_download(corpus)),
+        # With a realistic round trip the search pool is what matters
+        ('download_latency_serial_search', lambda: bench_download(
+            corpus, server_args = {'latency': 0.05}, search_workers = 1)),
+        ('download_latency_concurrent_search', lambda: bench_download(
+            corpus, server_args = {'latency': 0.05}, search_workers = 8)),
+        ('seasons_serial', lambda: bench_seasons(corpus, workers = 1)),
+        ('seasons_concurrent', lambda: bench_seasons(corpus, workers = 8)),
+    ]
+
+    results = {}
+    for name, scenario in scenarios:
+        try:
+            results[name] = scenario()
+        except ImportError as e:
+            # The download needs the full set of dependencies
+            results[name] = {'skipped': str(e)}
+    return results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Offline SubDownloader benchmarks")
+    parser.add_argument("--output", help = "JSON file to write the results to")
+    parser.add_argument("--scale", type = float, default = 1.0,
+                        help = "multiplies the size of the synthetic corpus")
+    parser.add_argument("--repeat", type = int, default = 3,
+                        help = "runs of each scenario, the best is kept")
+    parser.add_argument("--label", default = "", help = "name stored with the results")
+    args = parser.parse_args(argv)
+
+    results = run_all(scale = args.scale, repeat = args.repeat)
+    report = {'label': args.label, 'time': time.time(), 'python': sys.version.split()[0],
+              'platform': platform.platform(), 'scale': args.scale, 'results': results}
+
+    for name, result in results.items():
+        if 'skipped' in result:
+            print("%-30s skipped (%s)" % (name, result['skipped']))
+        else:
+            print("%-30s %.4f s" % (name, result['seconds']))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
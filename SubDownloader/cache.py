@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+
+class SubtitleCache(object):
+    """
+    On disk cache of downloaded subtitles.
+
+    Each SRT is stored once under the sha1 hash of its content. An index
+    maps IMDB ID's to the IDSubtitleFile found when searching, and each
+    IDSubtitleFile to the hash of its content, so both the search and
+    download steps can be skipped for anything seen before.
+
+    The least recently used files are removed once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes = 2**30):
+        """
+        :param path The folder the cache lives in. Created if missing.
+        :param max_bytes The size the stored subtitles may grow to
+            before old ones are evicted.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(path, "index.json")
+        self.objects_path = os.path.join(path, "objects")
+
+        self.episodes = {}  # "imdb_id:language" -> IDSubtitleFile
+        self.files = OrderedDict()  # IDSubtitleFile -> [digest, size], oldest first
+        self.refs = {}  # digest -> number of IDSubtitleFile using it
+        self.total_bytes = 0
+
+        if not os.path.exists(self.objects_path):
+            os.makedirs(self.objects_path)
+        self.load()
+
+
+    def load(self):
+        """ Reads the index back from disk if it exists """
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, "r") as f:
+            index = json.load(f)
+
+        self.episodes = index['episodes']
+        self.files = OrderedDict()
+        self.refs = {}
+        self.total_bytes = 0
+        for sub_id, digest, size in index['files']:
+            self.files[sub_id] = [digest, size]
+            if digest not in self.refs:
+                self.refs[digest] = 0
+                self.total_bytes += size
+            self.refs[digest] += 1
+
+    def save(self):
+        """ Writes the index to disk, replacing the old one in one step """
+        index = {'episodes': self.episodes,
+                 'files': [[sub_id, digest, size] for sub_id, (digest, size) in self.files.items()]}
+        temp_file = self.index_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_file, self.index_file)
+
+
+    def _key(self, imdb_id, language):
+        return str(imdb_id) + ":" + language
+
+    def _object_file(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def get_sub_id(self, imdb_id, language = 'eng'):
+        """ Returns the IDSubtitleFile found for an IMDB ID or None """
+        return self.episodes.get(self._key(imdb_id, language))
+
+    def set_sub_id(self, imdb_id, sub_id, language = 'eng'):
+        """ Records the IDSubtitleFile chosen for an IMDB ID """
+        self.episodes[self._key(imdb_id, language)] = str(sub_id)
+
+    def __contains__(self, sub_id):
+        return str(sub_id) in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+
+    def get(self, sub_id):
+        """
+        Returns the SRT for an IDSubtitleFile, or None if it isn't cached.
+        """
+        sub_id = str(sub_id)
+        if sub_id not in self.files:
+            return None
+        digest = self.files[sub_id][0]
+        try:
+            with open(self._object_file(digest), "rb") as f:
+                srt = f.read().decode("utf-8")
+        except FileNotFoundError:
+            self._forget(sub_id)
+            return None
+
+        self.files.move_to_end(sub_id)
+        return srt
+
+    def get_by_imdb(self, imdb_id, language = 'eng'):
+        """ Returns the cached SRT for an IMDB ID or None """
+        sub_id = self.get_sub_id(imdb_id, language)
+        if sub_id is None:
+            return None
+        return self.get(sub_id)
+
+    def put(self, sub_id, srt):
+        """
+        Stores the SRT for an IDSubtitleFile. Content that is already
+        stored under the same hash is not written again.
+        """
+        sub_id = str(sub_id)
+        data = srt.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+
+        if sub_id in self.files:
+            if self.files[sub_id][0] == digest:
+                self.files.move_to_end(sub_id)
+                return
+            self._forget(sub_id)
+
+        if digest not in self.refs:
+            object_file = self._object_file(digest)
+            if not os.path.exists(os.path.dirname(object_file)):
+                os.makedirs(os.path.dirname(object_file))
+            with open(object_file, "wb") as f:
+                f.write(data)
+            self.refs[digest] = 0
+            self.total_bytes += len(data)
+        self.refs[digest] += 1
+        self.files[sub_id] = [digest, len(data)]
+
+        self.evict()
+
+    def _forget(self, sub_id):
+        """ Drops an IDSubtitleFile and removes its content if unused """
+        digest, size = self.files.pop(sub_id)
+        self.refs[digest] -= 1
+        if self.refs[digest] == 0:
+            del self.refs[digest]
+            self.total_bytes -= size
+            try:
+                os.remove(self._object_file(digest))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """ Removes the least recently used subtitles until under max_bytes """
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            sub_id = next(iter(self.files))
+            self._forget(sub_id)
+
+    def clear(self):
+        """ Removes everything from the cache """
+        for sub_id in list(self.files):
+            self._forget(sub_id)
+        self.episodes = {}
+        self.save()
@@ -0,0 +1,290 @@
+"""
+Command line bulk downloader, installed as subdownloader.
+
+Reads a manifest with one title or IMDB ID per line, finds the IMDB ID's
+of every title, then searches, downloads and saves their subtitles as a
+resumable download job:
+
+    subdownloader titles.txt --credentials accounts.txt --data-path ./Data/
+
+Lines starting with # are ignored. Running the same command again picks
+up where an earlier run stopped.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+
+from SubDownloader.jobs import DownloadJob
+from SubDownloader.metrics import Metrics, JsonLinesSink
+import SubDownloader.utils as utl
+
+
+IMDB_ID_PATTERN = re.compile(r"^(?:tt)?(\d{5,})$")
+
+
+def read_manifest(path):
+    """
+    Returns the entries of a manifest file as (kind, value) pairs, where
+    kind is 'id' for an IMDB ID and 'title' for anything else.
+    """
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            match = IMDB_ID_PATTERN.match(line)
+            if match is not None:
+                entries.append(('id', match.group(1)))
+            else:
+                entries.append(('title', line))
+    return entries
+
+
+def read_credentials(path):
+    """
+    Returns (username, password, quota) for each line of a credentials
+    file written as "username password [quota]".
+    """
+    credentials = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 0 or parts[0].startswith("#"):
+                continue
+            if len(parts) < 2:
+                raise Exception("Credentials need a username and password on each line")
+            quota = int(parts[2]) if len(parts) > 2 else None
+            credentials.append((parts[0], parts[1], quota))
+    return credentials
+
+
+class BulkRunner(object):
+    """
+    Runs the find, search, download and save pipeline for a manifest.
+
+    IMDB lookups are made by find_workers threads, each with its own
+    SubDownloader since find keeps the search term on the object. The
+    searches and downloads are made by a single download_job, which
+    searches with search_workers threads.
+    """
+
+    def __init__(self, downloader, find_workers = 4, series = False, ia_factory = None):
+        """
+        :param downloader The SubDownloader used for the download job.
+            Its settings are copied for the find workers.
+        :param series Treats titles as series and IMDB ID's as series ID's,
+            downloading every episode.
+        :param ia_factory Makes the IMDB access object of each find worker.
+            Defaults to a new IMDb() per thread, or the downloader's own 
+            with a single worker.
+        """
+        self.downloader = downloader
+        self.find_workers = find_workers
+        self.series = series
+        self.ia_factory = ia_factory
+        self.failed = []
+        self._local = threading.local()
+
+    def _finder(self):
+        """ Returns a SubDownloader for IMDB lookups in the current thread """
+        finder = getattr(self._local, 'finder', None)
+        if finder is None:
+            sd = self.downloader
+            if self.ia_factory is not None:
+                ia = self.ia_factory()
+            elif self.find_workers <= 1:
+                ia = sd.ia
+            else:
+                ia = None
+            finder = type(sd)(verbose = sd.verbose, ia = ia, server_url = sd.server_url)
+            finder.lookup_cache = sd.lookup_cache
+            finder.metrics = sd.metrics
+            self._local.finder = finder
+        return finder
+
+    def find_ids(self, entry):
+        """ Returns the IMDB ID's to download for one manifest entry """
+        kind, value = entry
+        finder = self._finder()
+        if kind == 'id' and not self.series:
+            return [value]
+        if kind == 'id':
+            result = finder.find_from_id_tv_show(value)
+        else:
+            result = finder.find(value, force_series = self.series)
+
+        if result.data['kind'] == 'tv series':
+            return utl.get_epsiode_ids(utl.get_episode_metas(result))
+        return [result.movieID]
+
+    def resolve(self, entries):
+        """
+        Finds the IMDB ID's of every manifest entry. Entries that can't be
+        found are printed and left out. Entries whose lookup failed for
+        any other reason are printed and kept in self.failed, so the run
+        isn't reported as finished. Returns the ID's without repeats.
+        """
+        from SubDownloader.SubDownloader import TitleNotFound
+
+        self.failed = []
+
+        def safe_find(entry):
+            try:
+                return self.find_ids(entry)
+            except TitleNotFound as e:
+                print("Couldn't find", entry[1], "~", e)
+            except Exception as e:
+                print("Looking up", entry[1], "failed ~", repr(e))
+                self.failed.append(entry)
+            return []
+
+        if self.find_workers > 1 and len(entries) > 1:
+            with ThreadPoolExecutor(max_workers = self.find_workers) as pool:
+                found = list(pool.map(safe_find, entries))
+        else:
+            found = [safe_find(entry) for entry in entries]
+
+        imdb_ids = []
+        seen = set()
+        for ids in found:
+            for imdb_id in ids:
+                if str(imdb_id) not in seen:
+                    seen.add(str(imdb_id))
+                    imdb_ids.append(imdb_id)
+        return imdb_ids
+
+    def run(self, entries, manifest_path = None, raw = False):
+        """
+        Runs the whole pipeline and returns a dictionary summarising it,
+        with the time each stage took and the download job's counts.
+
+        :param raw saves the gzipped files from OpenSubtitles as .srt.gz
+        """
+        start = time.perf_counter()
+        imdb_ids = self.resolve(entries)
+        find_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            job = self.downloader.download_job(imdb_ids, manifest_path = manifest_path, raw = raw)
+        except Exception as e:
+            # Such as every account running out. The manifest has the work done so far.
+            print("The download stopped early ~", e)
+            if manifest_path is None:
+                manifest_path = self.downloader.data_path+"job_manifest.json"
+            job = DownloadJob(manifest_path)
+        download_seconds = time.perf_counter() - start
+
+        return {'entries': len(entries), 'imdb_ids': len(imdb_ids),
+                'lookup_failures': len(self.failed),
+                'find_seconds': find_seconds, 'download_seconds': download_seconds,
+                'states': job.summary(),
+                'finished': job.is_finished() and len(self.failed) == 0}
+
+
+def print_summary(summary, metrics = None):
+    """ Prints the throughput of a bulk run """
+    total = summary['find_seconds'] + summary['download_seconds']
+    saved = summary['states'].get('saved', 0)
+    print("Manifest entries:  ", summary['entries'])
+    print("IMDB ID's:         ", summary['imdb_ids'])
+    if summary.get('lookup_failures'):
+        print("Failed lookups:    ", summary['lookup_failures'])
+    print("Find:               %.1f s (%.2f entries/s)" % (
+        summary['find_seconds'], summary['entries'] / max(summary['find_seconds'], 1e-9)))
+    print("Search + download:  %.1f s (%.2f ID's/s)" % (
+        summary['download_seconds'], summary['imdb_ids'] / max(summary['download_seconds'], 1e-9)))
+    print("Total:              %.1f s (%.2f saved/s)" % (total, saved / max(total, 1e-9)))
+    print("States:            ", ", ".join("%s %d" % item for item in sorted(summary['states'].items())))
+    if metrics is not None:
+        counters = {}
+        for counter in metrics.snapshot()['counters']:
+            counters[counter['name']] = counters.get(counter['name'], 0) + counter['value']
+        print("Requests:           %d searches, %d downloads, %d rate limited" % (
+            counters.get('search_requests', 0), counters.get('download_requests', 0),
+            counters.get('rate_limited', 0)))
+        print("Downloaded:         %.2f MB" % (counters.get('bytes_downloaded', 0) / 1e6))
+    if not summary['finished']:
+        print("The job isn't finished, run again to carry on.")
+
+
+def bulk_download(argv = None):
+    """
+    Runs the command line with a list of arguments and returns the
+    summary dictionary of BulkRunner.run.
+    """
+    parser = argparse.ArgumentParser(description = "Bulk download subtitles for a manifest of titles or IMDB ID's")
+    parser.add_argument("manifest", help = "file with one title or IMDB ID per line")
+    parser.add_argument("--data-path", default = "./Data/", help = "folder the SRT files are saved in")
+    parser.add_argument("--credentials", help = "file of 'username password [quota]' lines")
+    parser.add_argument("--account-file", help = "JSON file keeping account usage between runs")
+    parser.add_argument("--job", help = "job manifest, defaults to job_manifest.json in the data path")
+    parser.add_argument("--series", action = "store_true",
+                        help = "treat titles and ID's as series and download every episode")
+    parser.add_argument("--gzip", action = "store_true",
+                        help = "save the files as .srt.gz without decoding them")
+    parser.add_argument("--find-workers", type = int, default = 4, help = "threads for IMDB lookups")
+    parser.add_argument("--search-workers", type = int, default = 8,
+                        help = "threads for OpenSubtitles searches")
+    parser.add_argument("--search-batch-size", type = int, default = 1,
+                        help = "IMDB ID's sent in each search")
+    parser.add_argument("--cache", help = "folder for the subtitle cache")
+    parser.add_argument("--lookup-cache", help = "SQLite file caching IMDB lookups")
+    parser.add_argument("--server-url", help = "OpenSubtitles XML-RPC address")
+    parser.add_argument("--events", help = "JSON lines file to write metric events to")
+    parser.add_argument("--prometheus", help = "file to write the metrics to in Prometheus format")
+    parser.add_argument("--verbose", type = int, default = 1)
+    args = parser.parse_args(argv)
+
+    from SubDownloader.SubDownloader import SubDownloader
+
+    data_path = args.data_path
+    if not data_path.endswith(("/", os.sep)):
+        data_path += os.sep
+
+    sd = SubDownloader(data_path = data_path, verbose = args.verbose,
+                       search_workers = args.search_workers,
+                       search_batch_size = args.search_batch_size,
+                       account_file = args.account_file, server_url = args.server_url)
+    if args.credentials is not None:
+        for username, password, quota in read_credentials(args.credentials):
+            sd.add_login(username, password, quota = quota)
+    if args.cache is not None:
+        sd.set_cache(args.cache)
+    if args.lookup_cache is not None:
+        sd.set_lookup_cache(args.lookup_cache)
+
+    sink = JsonLinesSink(args.events) if args.events is not None else None
+    metrics = Metrics(sinks = [sink] if sink is not None else [])
+    sd.set_metrics(metrics)
+
+    entries = read_manifest(args.manifest)
+    runner = BulkRunner(sd, find_workers = args.find_workers, series = args.series)
+    try:
+        summary = runner.run(entries, manifest_path = args.job, raw = args.gzip)
+    finally:
+        if sink is not None:
+            sink.close()
+
+    print_summary(summary, metrics)
+    if args.prometheus is not None:
+        metrics.write_prometheus(args.prometheus)
+    return summary
+
+
+def main(argv = None):
+    """
+    The subdownloader command. Returns the exit status: 0 when the job
+    finished, 1 when there is work left for another run.
+    """
+    summary = bulk_download(argv)
+    return 0 if summary['finished'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
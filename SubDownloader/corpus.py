@@ -0,0 +1,90 @@
+from array import array
+
+import SubDownloader.utils as utl
+
+
+class TokenCorpus(object):
+    """
+    A set of tokenized documents sharing one vocabulary.
+
+    Every word is given an integer code once, starting at 1, and each
+    document is kept as an array('I') of codes. The coded documents can
+    be passed straight to compress_by_token_ratio, _compress, _hhat and
+    normalised_paired_compression, and give the same values as their
+    token lists. Two documents are only paired if both are coded.
+    """
+
+    def __init__(self):
+        self.vocab = {}  # word -> code
+        self.words = [None]  # code -> word, code 0 is unused
+        self.documents = {}  # key -> array('I') of codes
+
+
+    @classmethod
+    def from_srt_dict(cls, srt_dict, runtime = None):
+        """
+        Builds a corpus from a dictionary of ID, SRT such as the one
+        returned by download_opensubtitles or load_from_file.
+        Files that can't be read are left out.
+        """
+        corpus = cls()
+        for key, srt in srt_dict.items():
+            try:
+                corpus.add(key, utl.iter_srt_tokens(srt, runtime = runtime))
+            except ValueError:
+                print("Couldn't read the subtitles of", key)
+        return corpus
+
+    def encode(self, tokens):
+        """ Returns the codes of a token list, adding new words to the vocabulary """
+        vocab = self.vocab
+        words = self.words
+        coded = array('I')
+        for tok in tokens:
+            code = vocab.get(tok)
+            if code is None:
+                code = len(words)
+                vocab[tok] = code
+                words.append(tok)
+            coded.append(code)
+        return coded
+
+    def add(self, key, tokens):
+        """ Codes a token list and stores it under key. Returns the coded document """
+        self.documents[key] = self.encode(tokens)
+        return self.documents[key]
+
+    def decode(self, key):
+        """ Returns the words of a document """
+        words = self.words
+        return [words[code] for code in self.documents[key]]
+
+
+    def __getitem__(self, key):
+        return self.documents[key]
+
+    def __contains__(self, key):
+        return key in self.documents
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def keys(self):
+        return self.documents.keys()
+
+    def items(self):
+        return self.documents.items()
+
+    def vocab_size(self):
+        return len(self.words) - 1
+
+    def n_tokens(self):
+        """ Returns the number of tokens across all documents """
+        return sum(len(doc) for doc in self.documents.values())
+
+    def nbytes(self):
+        """ Returns the bytes used by the coded documents """
+        return sum(doc.itemsize * len(doc) for doc in self.documents.values())
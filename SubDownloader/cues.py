@@ -0,0 +1,166 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+import SubDownloader.utils as utl
+
+
+def parse_time(value):
+    """
+    Returns a time in milliseconds from a number of milliseconds or a
+    string such as '1:05:00' or '00:01:02,500'. Two numbers such as
+    '00:10' are read as hours and minutes.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip()
+    ms = 0
+    if ',' in value or '.' in value:
+        value, fraction = value.replace('.', ',').split(',', 1)
+        ms = int(fraction[:3].ljust(3, "0"))
+    parts = [int(part) for part in value.split(':')]
+    if len(parts) == 2:
+        # Read as hours and minutes
+        parts = parts + [0]
+    if len(parts) != 3:
+        raise Exception("Can't read the time " + value)
+    hours, minutes, seconds = parts
+    return ((hours*60 + minutes)*60 + seconds)*1000 + ms
+
+
+class CueTable(object):
+    """
+    The cues of a subtitle with their timing.
+
+    Start and end times are kept as integer milliseconds in arrays, and
+    each cue's words are a slice of one shared token list given by the
+    offsets array, so cue i has tokens[offsets[i]:offsets[i+1]]. The
+    tokens are the same as process_srt gives.
+
+    When the cues are in time order, finding the cues or tokens of a
+    time range is a binary search rather than a parse of the file.
+    """
+
+    def __init__(self):
+        self.starts = array('q')  # -1 where the time couldn't be read
+        self.ends = array('q')
+        self.offsets = array('I', [0])
+        self.tokens = []
+        self.in_order = True
+
+
+    @classmethod
+    def from_srt(cls, srt, runtime = None, fps = 23.976):
+        """
+        Reads the cues of an SRT or MicroDVD subtitle, given as a string,
+        an open file or lines.
+
+        :param runtime Stops at the first cue starting after this many
+            minutes. Unlike process_srt, which only reads the minutes of
+            the timing, the hours are counted too.
+        :param fps The frame rate used to time MicroDVD frames.
+        """
+        table = cls()
+        last_cue = None
+        try:
+            for cue, words in utl._srt_word_chunks(srt, runtime = runtime, times = True, fps = fps):
+                if cue[0] != last_cue:
+                    last_cue = cue[0]
+                    table._add_cue(cue[1], cue[2])
+                table.tokens.extend(words)
+                table.offsets[-1] = len(table.tokens)
+        except Exception as e:
+            print(e)
+            raise ValueError
+        return table
+
+    def _add_cue(self, start, end):
+        start = -1 if start is None else start
+        if len(self.starts) > 0 and start < self.starts[-1]:
+            self.in_order = False
+        self.starts.append(start)
+        self.ends.append(-1 if end is None else end)
+        self.offsets.append(self.offsets[-1])
+
+    def add(self, start, end, words):
+        """ Adds a cue to the end of the table """
+        self._add_cue(start, end)
+        self.tokens.extend(words)
+        self.offsets[-1] = len(self.tokens)
+
+
+    def __len__(self):
+        return len(self.starts)
+
+    def words(self, i):
+        """ Returns the words of cue i """
+        return self.tokens[self.offsets[i]:self.offsets[i+1]]
+
+    def cue(self, i):
+        """ Returns (start, end, words) of cue i """
+        return self.starts[i], self.ends[i], self.words(i)
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self.cue(i)
+
+    def cue_range(self, start = None, end = None):
+        """
+        Returns the first and last+1 index of the cues starting in
+        [start, end) by binary search. The times are in milliseconds or
+        strings for parse_time. Needs the cues in time order.
+        """
+        start = 0 if start is None else parse_time(start)
+        end = None if end is None else parse_time(end)
+        if not self.in_order:
+            raise Exception("The cues aren't in time order, use cues_between")
+        first = bisect_left(self.starts, start)
+        last = len(self.starts) if end is None else bisect_left(self.starts, end)
+        return first, max(first, last)
+
+    def cues_between(self, start = None, end = None):
+        """ Returns the indexes of the cues starting in [start, end) """
+        if self.in_order:
+            first, last = self.cue_range(start, end)
+            return list(range(first, last))
+        start = 0 if start is None else parse_time(start)
+        end = None if end is None else parse_time(end)
+        return [i for i, cue_start in enumerate(self.starts)
+                if cue_start >= start and (end is None or cue_start < end)]
+
+    def tokens_between(self, start = None, end = None):
+        """
+        Returns the tokens of the cues starting in [start, end), e.g.
+        tokens_between('00:10', '00:15') for minutes 10 to 15.
+        """
+        if self.in_order:
+            first, last = self.cue_range(start, end)
+            return self.tokens[self.offsets[first]:self.offsets[last]]
+        tokens = []
+        for i in self.cues_between(start, end):
+            tokens.extend(self.words(i))
+        return tokens
+
+    def first_minutes(self, minutes):
+        """ Returns the tokens of the cues starting in the first minutes """
+        return self.tokens_between(0, minutes*60000)
+
+    def cue_at(self, time):
+        """ Returns the index of the cue on screen at a time, or None """
+        time = parse_time(time)
+        if self.in_order:
+            i = bisect_right(self.starts, time) - 1
+            candidates = [i] if i >= 0 else []
+        else:
+            candidates = range(len(self.starts))
+        for i in candidates:
+            if self.starts[i] <= time < self.ends[i]:
+                return i
+        return None
+
+    def cue_of_token(self, offset):
+        """ Returns the index of the cue holding a token offset """
+        return bisect_right(self.offsets, offset) - 1
+
+    def nbytes(self):
+        """ Returns the bytes used by the time and offset arrays """
+        return sum(column.itemsize * len(column) for column in (self.starts, self.ends, self.offsets))
@@ -0,0 +1,248 @@
+from array import array
+import json
+import os
+import random
+import zlib
+
+
+# A Mersenne prime larger than any shingle hash
+_PRIME = (1 << 61) - 1
+
+
+class MinHashIndex(object):
+    """
+    Finds subtitles whose token streams are nearly the same, such as
+    re-timed uploads of one file or a film and its director's cut.
+
+    Each document is cut into shingles of a few tokens and summarised by a
+    MinHash signature, whose share of equal values estimates the Jaccard
+    similarity of two shingle sets. The signature is made with one
+    permutation hashing: every shingle is hashed once into one of
+    num_perm bins and the smallest value of each bin is kept, with empty
+    bins filled from the next full one. This takes one pass over the
+    shingles rather than one per signature value.
+
+    The signatures are split into bands and hashed into buckets (locality
+    sensitive hashing), so a query only compares against documents
+    sharing a bucket rather than every document in the index.
+
+    The index can be saved as JSON next to the subtitles it covers.
+    """
+
+    def __init__(self, num_perm = 64, bands = 16, shingle = 5, threshold = 0.8,
+                 seed = 1, path = None, min_tokens = 50):
+        """
+        :param num_perm The length of each signature.
+        :param bands The number of LSH bands, must divide num_perm. More
+            bands find pairs with lower similarity.
+        :param shingle The number of tokens in each shingle.
+        :param threshold The estimated Jaccard similarity from which two
+            documents count as near duplicates.
+        :param path A JSON file to load the index from if it exists, and
+            save it to.
+        :param min_tokens Documents with fewer tokens are too short to
+            compare, e.g. a subtitle holding only music notes, so they are
+            never indexed or flagged as duplicates.
+        """
+        if num_perm % bands != 0:
+            raise Exception("bands must divide num_perm")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        self.threshold = threshold
+        self.seed = seed
+        self.path = path
+        self.min_tokens = max(min_tokens, shingle)
+
+        rand = random.Random(seed)
+        self.perm = (rand.randrange(1, _PRIME), rand.randrange(0, _PRIME))
+
+        self.signatures = {}  # key -> signature
+        self.duplicates = {}  # key -> key of the document it duplicates
+        self.buckets = [{} for _ in range(bands)]  # band -> band values -> [keys]
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+
+    def _shingle_hashes(self, tokens):
+        """ Returns the set of 32 bit hashes of every shingle of a token list """
+        k = self.shingle
+        if isinstance(tokens, array):
+            # Coded documents are hashed by their bytes
+            data = tokens.tobytes()
+            width = tokens.itemsize * k
+            return set(zlib.crc32(data[i:i+width])
+                       for i in range(0, max(1, len(data) - width + tokens.itemsize), tokens.itemsize))
+        tokens = list(tokens)
+        return set(zlib.crc32(" ".join(tokens[i:i+k]).encode("utf-8"))
+                   for i in range(max(1, len(tokens) - k + 1)))
+
+    def signature(self, tokens):
+        """
+        Returns the MinHash signature of a token list from process_srt,
+        or of a coded document from a TokenCorpus.
+        """
+        num_perm = self.num_perm
+        a, b = self.perm
+        signature = [None] * num_perm
+        for x in self._shingle_hashes(tokens):
+            value, bin_ = divmod((a*x + b) % _PRIME, num_perm)
+            if signature[bin_] is None or value < signature[bin_]:
+                signature[bin_] = value
+        
+        # Fill each empty bin from the next full one, marked by the distance
+        if all(value is None for value in signature):
+            return [_PRIME] * num_perm
+        step = _PRIME // num_perm + 1
+        for i in range(num_perm):
+            if signature[i] is None:
+                distance = 1
+                while signature[(i + distance) % num_perm] is None:
+                    distance += 1
+                signature[i] = signature[(i + distance) % num_perm] + step * distance
+        return signature
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, tuple(signature[band*rows:(band+1)*rows])
+
+    def similarity(self, signature_a, signature_b):
+        """ Estimates the Jaccard similarity of two signatures """
+        same = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+        return same / self.num_perm
+
+
+    def add(self, key, tokens = None, signature = None):
+        """ Adds a document by its tokens or a signature already made """
+        if signature is None:
+            signature = self.signature(tokens)
+        key = str(key)
+        if key in self.signatures:
+            self.remove(key)
+        self.signatures[key] = list(signature)
+        for band, values in self._band_keys(signature):
+            self.buckets[band].setdefault(values, []).append(key)
+        return signature
+
+    def remove(self, key):
+        key = str(key)
+        signature = self.signatures.pop(key, None)
+        self.duplicates.pop(key, None)
+        if signature is None:
+            return
+        for band, values in self._band_keys(signature):
+            bucket = self.buckets[band].get(values, [])
+            if key in bucket:
+                bucket.remove(key)
+            if len(bucket) == 0:
+                self.buckets[band].pop(values, None)
+
+    def query(self, tokens = None, signature = None, threshold = None):
+        """
+        Returns (key, estimated similarity) of the documents at least as
+        similar as threshold, most similar first. Only documents sharing
+        an LSH bucket are compared. A document too short to compare has
+        no matches.
+        """
+        if signature is None and self.too_short(tokens):
+            return []
+        if signature is None:
+            signature = self.signature(tokens)
+        if threshold is None:
+            threshold = self.threshold
+        candidates = set()
+        for band, values in self._band_keys(signature):
+            candidates.update(self.buckets[band].get(values, ()))
+        matches = []
+        for key in candidates:
+            score = self.similarity(signature, self.signatures[key])
+            if score >= threshold:
+                matches.append((key, score))
+        matches.sort(key = lambda match: (-match[1], match[0]))
+        return matches
+
+    def too_short(self, tokens):
+        """ True if a document has too few tokens to be compared """
+        return len(tokens) < self.min_tokens
+
+    def add_unique(self, key, tokens = None, signature = None):
+        """
+        Adds a document unless it is a near duplicate of one already
+        indexed, in which case it is recorded as a duplicate of that one.
+        Returns the key of the document kept, which is key if it is new
+        or too short to compare.
+        """
+        if signature is None and self.too_short(tokens):
+            return str(key)
+        if signature is None:
+            signature = self.signature(tokens)
+        key = str(key)
+        for match, score in self.query(signature = signature):
+            if match != key:
+                self.duplicates[key] = match
+                return match
+        self.add(key, signature = signature)
+        return key
+
+    def is_duplicate(self, key):
+        """ True if a key was found to duplicate another document """
+        return str(key) in self.duplicates
+
+    def __contains__(self, key):
+        key = str(key)
+        return key in self.signatures or key in self.duplicates
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+    def save(self, path = None):
+        """ Writes the index as JSON, replacing the old file in one step """
+        path = path if path is not None else self.path
+        if path is None:
+            raise Exception("No path to save the index to")
+        settings = {'num_perm': self.num_perm, 'bands': self.bands, 'shingle': self.shingle,
+                    'threshold': self.threshold, 'seed': self.seed}
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({'settings': settings, 'signatures': self.signatures,
+                       'duplicates': self.duplicates}, f)
+        os.replace(temp_file, path)
+
+    def load(self, path):
+        """ Reads an index saved with save. Its settings must match this index """
+        with open(path, "r") as f:
+            saved = json.load(f)
+        settings = saved['settings']
+        if (settings['num_perm'], settings['bands'], settings['shingle'], settings['seed']) != \
+                (self.num_perm, self.bands, self.shingle, self.seed):
+            raise Exception("The saved index was made with different settings")
+        for key, signature in saved['signatures'].items():
+            self.add(key, signature = signature)
+        self.duplicates.update(saved['duplicates'])
+
+
+def collapse_near_duplicates(token_dict, index = None, threshold = 0.8):
+    """
+    Drops near duplicate documents from a dictionary of key, tokens such
+    as a TokenCorpus or process_srt results. The first of each group is
+    kept. Returns the kept dictionary and a dictionary of each dropped key
+    to the key it duplicates.
+
+    :param index A MinHashIndex to check against and add to, so earlier
+        documents count too. A new one is made by default.
+    """
+    if index is None:
+        index = MinHashIndex(threshold = threshold)
+    kept = {}
+    dropped = {}
+    for key, tokens in token_dict.items():
+        match = index.add_unique(key, tokens)
+        if match == str(key):
+            kept[key] = tokens
+        else:
+            dropped[key] = match
+    return kept, dropped
@@ -0,0 +1,169 @@
+from array import array
+
+import SubDownloader.utils as utl
+
+
+# Stored for a season or episode that isn't a number
+UNKNOWN = -1
+
+
+def _number(value):
+    """ Returns a season or episode as a number, or UNKNOWN for a label """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return UNKNOWN
+
+
+class EpisodeTable(object):
+    """
+    The episodes of one or more series kept as columns.
+
+    Season, episode and IMDB ID are arrays of numbers, and the titles and
+    air dates are lists sharing the strings IMDB returned. An index maps
+    each IMDB ID to its row. SRT's are not stored in the table; they are
+    read on demand from a source such as a SubtitleArchive or a data path.
+
+    Iterating gives the dictionaries of get_episode_metas, so a table can
+    be passed to get_epsiode_ids and add_srt_to_meta as it is.
+
+    IMDB keeps episodes it can't place under labels such as
+    'unknown season'. Those are stored as UNKNOWN in the arrays with the
+    label kept beside them, and given back as the label.
+    """
+
+    def __init__(self):
+        self.seasons = array('i')
+        self.episodes = array('i')
+        self.ids = array('q')  # IMDB ID's as numbers
+        self.titles = []
+        self.air_dates = []  # None where IMDB has no date
+        self.labels = {}  # row -> (season, episode) where either isn't a number
+        self.index = {}  # IMDB ID string -> row
+        self.srt_source = None
+
+
+    @classmethod
+    def from_seasons(cls, seasons):
+        """
+        Builds a table from an iterable of (season, dictionary of episode
+        number, episode), such as SubDownloader.iter_seasons.
+        """
+        table = cls()
+        for season, episodes in seasons:
+            for episode, movie_obj in episodes.items():
+                table.add(season, episode, movie_obj.movieID, movie_obj.data['title'],
+                          movie_obj.data.get('original air date'))
+        return table
+
+    @classmethod
+    def from_series(cls, series_obj):
+        """ Builds a table from a series with its episodes, like get_episode_metas """
+        table = cls.from_seasons(series_obj['episodes'].items())
+        print("Returning", len(table), " epsiodes.")
+        return table
+
+    @classmethod
+    def from_metas(cls, meta_list):
+        """ Builds a table from a list of get_episode_metas dictionaries """
+        table = cls()
+        for meta in meta_list:
+            table.add(meta['season'], meta['episode'], meta['imdb_id'], meta['title'],
+                      meta.get('air_date'))
+        return table
+
+    def add(self, season, episode, imdb_id, title, air_date = None):
+        """ Adds an episode as a new row. Returns the row """
+        row = len(self.ids)
+        season_number = _number(season)
+        episode_number = _number(episode)
+        if season_number == UNKNOWN or episode_number == UNKNOWN:
+            self.labels[row] = (season, episode)
+        self.seasons.append(season_number)
+        self.episodes.append(episode_number)
+        self.ids.append(int(imdb_id))
+        self.titles.append(title)
+        self.air_dates.append(air_date)
+        self.index[self.imdb_id(row)] = row
+        return row
+
+
+    def imdb_id(self, row):
+        """ Returns the IMDB ID of a row as IMDB writes it, e.g. '0944947' """
+        return "%07d" % self.ids[row]
+
+    def row(self, imdb_id):
+        """ Returns the row of an IMDB ID """
+        return self.index["%07d" % int(imdb_id)]
+
+    def meta(self, row):
+        """ Returns a row as a get_episode_metas dictionary """
+        season, episode = self.labels.get(row, (self.seasons[row], self.episodes[row]))
+        meta = {"season": season, "episode": episode,
+                "imdb_id": self.imdb_id(row), 'title': self.titles[row]}
+        if self.air_dates[row] is not None:
+            meta["air_date"] = self.air_dates[row]
+        return meta
+
+    def __getitem__(self, imdb_id):
+        return self.meta(self.row(imdb_id))
+
+    def __contains__(self, imdb_id):
+        try:
+            return "%07d" % int(imdb_id) in self.index
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield self.meta(row)
+
+    def to_metas(self):
+        """ Returns the list of dictionaries get_episode_metas gives """
+        return list(self)
+
+    def imdb_ids(self):
+        """ Returns every IMDB ID in row order, like get_epsiode_ids """
+        return [self.imdb_id(row) for row in range(len(self.ids))]
+
+    def season_ids(self, season):
+        """ Returns the IMDB ID's of one season """
+        return [self.imdb_id(row) for row in range(len(self.ids))
+                if self.labels.get(row, (self.seasons[row],))[0] == season]
+
+
+    def set_srt_source(self, source):
+        """
+        Sets where SRT's are read from when asked for.
+
+        :param source A SubtitleArchive, a dictionary of ID, SRT, or a data
+            path that <id>.srt or <id>.srt.gz files are read from.
+        """
+        self.srt_source = source
+
+    def srt(self, imdb_id):
+        """ Reads the SRT of an episode from the source, or None if there isn't one """
+        source = self.srt_source
+        if source is None:
+            raise Exception("The table has no SRT source, use set_srt_source")
+        if isinstance(source, str):
+            try:
+                return utl._read_srt_file(source, imdb_id)
+            except FileNotFoundError:
+                return None
+        return source.get(imdb_id)
+
+    def iter_with_srt(self):
+        """
+        Lazily yields the add_srt_to_meta dictionary of each episode that
+        has an SRT, reading one SRT at a time.
+        """
+        for row in range(len(self.ids)):
+            srt = self.srt(self.imdb_id(row))
+            if srt is not None:
+                meta = self.meta(row)
+                meta['srt'] = srt
+                yield meta
@@ -0,0 +1,75 @@
+import json
+import os
+
+
+# The states an IMDB ID moves through in a download job
+PENDING = "pending"  # not searched yet
+SEARCHED = "searched"  # searched but no subtitle was found
+RESOLVED = "resolved"  # subtitle file ID found
+DOWNLOADED = "downloaded"  # subtitle downloaded but not saved
+SAVED = "saved"  # subtitle saved to the data path
+MISSING = "missing"  # OpenSubtitles sent nothing for the subtitle file ID
+DUPLICATE = "duplicate"  # near duplicate of another subtitle, not saved
+
+
+class DownloadJob(object):
+    """
+    The manifest of a bulk download, kept as a JSON file.
+
+    Records the state of each IMDB ID and the subtitle file ID found for
+    it, so a job that stops part way through can be run again and only
+    does the work that is left.
+    """
+
+    def __init__(self, path):
+        """
+        :param path The JSON manifest file. Read back if it already exists.
+        """
+        self.path = path
+        self.entries = {}  # imdb_id -> {'state': ..., 'sub_id': ...}
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)['entries']
+
+
+    def save(self):
+        """ Writes the manifest, replacing the old one in one step """
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({'entries': self.entries}, f)
+        os.replace(temp_file, self.path)
+
+    def add(self, imdb_ids):
+        """ Adds IMDB ID's to the job. ID's already in the job are kept as they are """
+        for imdb_id in imdb_ids:
+            if str(imdb_id) not in self.entries:
+                self.entries[str(imdb_id)] = {'state': PENDING, 'sub_id': None}
+
+    def set_state(self, imdb_id, state, sub_id = None):
+        """ Moves an IMDB ID to a new state """
+        entry = self.entries[str(imdb_id)]
+        entry['state'] = state
+        if sub_id is not None:
+            entry['sub_id'] = sub_id
+
+    def state(self, imdb_id):
+        return self.entries[str(imdb_id)]['state']
+
+    def sub_id(self, imdb_id):
+        return self.entries[str(imdb_id)]['sub_id']
+
+    def with_state(self, *states):
+        """ Returns the IMDB ID's in any of the given states, in the order added """
+        return [imdb_id for imdb_id, entry in self.entries.items() if entry['state'] in states]
+
+    def summary(self):
+        """ Returns a dictionary with the number of IMDB ID's in each state """
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry['state']] = counts.get(entry['state'], 0) + 1
+        return counts
+
+    def is_finished(self):
+        """ True when every ID is saved, has no subtitles, is missing or is a duplicate """
+        return len(self.with_state(PENDING, RESOLVED, DOWNLOADED)) == 0
@@ -0,0 +1,85 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class LookupCache(object):
+    """
+    Persistent cache of IMDB lookups kept in a SQLite database.
+
+    Search results and series with their episodes are pickled under a
+    key such as "search:<term>" or "episodes:<imdb_id>". Entries older
+    than ttl seconds are treated as missing and fetched again.
+
+    One connection is shared by every thread, such as the workers of
+    iter_seasons, so each use of it holds a lock.
+    """
+
+    def __init__(self, path, ttl = 7*24*60*60):
+        """
+        :param path The SQLite file to use. Its folder is created if missing.
+        :param ttl The number of seconds an entry stays valid. None never expires.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS lookups "
+                          "(key TEXT PRIMARY KEY, value BLOB, created REAL)")
+        self.conn.commit()
+
+
+    def get(self, key):
+        """ Returns the cached value for a key or None if missing or expired """
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM lookups WHERE key = ?",
+                                    (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return None
+        return pickle.loads(value)
+
+    def put(self, key, value):
+        """ Stores a value under a key, replacing anything already there """
+        value = pickle.dumps(value)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)",
+                              (key, value, time.time()))
+            self.conn.commit()
+
+    def invalidate(self, key = None, prefix = None):
+        """
+        Removes cached entries. With no arguments everything is removed.
+
+        :param key removes only this key.
+        :param prefix removes every key starting with this, e.g. "search:".
+        """
+        with self.lock:
+            if key is not None:
+                self.conn.execute("DELETE FROM lookups WHERE key = ?", (key,))
+            elif prefix is not None:
+                self.conn.execute("DELETE FROM lookups WHERE substr(key, 1, ?) = ?",
+                                  (len(prefix), prefix))
+            else:
+                self.conn.execute("DELETE FROM lookups")
+            self.conn.commit()
+
+    def purge_expired(self):
+        """ Deletes every entry older than the ttl """
+        if self.ttl is None:
+            return
+        with self.lock:
+            self.conn.execute("DELETE FROM lookups WHERE created < ?", (time.time() - self.ttl,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
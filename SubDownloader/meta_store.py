@@ -0,0 +1,135 @@
+import json
+import os
+import pickle
+import sqlite3
+
+from SubDownloader.episodes import EpisodeTable
+
+
+# Keys of a get_episode_metas dictionary that have their own column
+_COLUMNS = ("season", "episode", "imdb_id", "title", "air_date")
+
+
+class MetaStore(object):
+    """
+    Episode metadata kept in a SQLite database, one row per IMDB ID.
+
+    Episodes are appended or replaced one row at a time and can be read
+    back for a single episode, series or season without loading the
+    rest. Keys of the metadata other than the usual columns are kept as
+    JSON, and SRT's are never stored.
+    """
+
+    def __init__(self, path):
+        """
+        :param path The SQLite file to use. Its folder is created if missing.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS episodes "
+                          "(imdb_id TEXT PRIMARY KEY, series_id TEXT, season INTEGER, "
+                          "episode INTEGER, title TEXT, air_date TEXT, extra TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS episodes_series "
+                          "ON episodes (series_id, season, episode)")
+        self.conn.commit()
+
+
+    def add(self, meta_list, series_id = None):
+        """
+        Adds episodes, replacing any already stored under the same IMDB ID.
+
+        :param meta_list get_episode_metas dictionaries or an EpisodeTable.
+        :param series_id The IMDB ID of the series they belong to.
+        Returns the number of episodes written.
+        """
+        rows = []
+        for meta in meta_list:
+            extra = dict((key, value) for key, value in meta.items()
+                         if key not in _COLUMNS and key != 'srt')
+            rows.append((str(meta['imdb_id']), None if series_id is None else str(series_id),
+                         meta.get('season'), meta.get('episode'), meta.get('title'),
+                         meta.get('air_date'), json.dumps(extra) if extra else None))
+        self.conn.executemany("INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return len(rows)
+
+    def _meta(self, row):
+        imdb_id, series_id, season, episode, title, air_date, extra = row
+        meta = {"season": season, "episode": episode, "imdb_id": imdb_id, 'title': title}
+        if air_date is not None:
+            meta["air_date"] = air_date
+        if extra is not None:
+            meta.update(json.loads(extra))
+        return meta
+
+    def get(self, imdb_id):
+        """ Returns the metadata of one episode, or None if it isn't stored """
+        row = self.conn.execute("SELECT * FROM episodes WHERE imdb_id = ?",
+                                (str(imdb_id),)).fetchone()
+        return None if row is None else self._meta(row)
+
+    def __contains__(self, imdb_id):
+        return self.conn.execute("SELECT 1 FROM episodes WHERE imdb_id = ?",
+                                 (str(imdb_id),)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def iter_series(self, series_id = None, season = None):
+        """
+        Lazily yields the metadata of a series in season and episode order.
+
+        :param series_id The series to read. None reads episodes stored
+            without a series.
+        :param season Only reads this season.
+        """
+        query = "SELECT * FROM episodes WHERE series_id IS ?"
+        args = [None if series_id is None else str(series_id)]
+        if season is not None:
+            query += " AND season = ?"
+            args.append(season)
+        query += " ORDER BY season, episode"
+        for row in self.conn.execute(query, args):
+            yield self._meta(row)
+
+    def series(self, series_id = None, season = None):
+        """ Returns the list of get_episode_metas dictionaries of a series """
+        return list(self.iter_series(series_id, season))
+
+    def table(self, series_id = None, season = None):
+        """ Returns a series as an EpisodeTable """
+        return EpisodeTable.from_metas(self.iter_series(series_id, season))
+
+    def series_ids(self):
+        """ Returns the ID of every series stored """
+        return [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT series_id FROM episodes WHERE series_id IS NOT NULL")]
+
+    def remove(self, imdb_id = None, series_id = None):
+        """ Removes one episode or every episode of a series """
+        if imdb_id is not None:
+            self.conn.execute("DELETE FROM episodes WHERE imdb_id = ?", (str(imdb_id),))
+        elif series_id is not None:
+            self.conn.execute("DELETE FROM episodes WHERE series_id = ?", (str(series_id),))
+        self.conn.commit()
+
+    def import_pickle(self, path, series_id = None):
+        """
+        Adds the episodes of a meta_object.pickle written by the old
+        save_meta_data. Returns the number of episodes added.
+        """
+        with open(path, "rb") as f:
+            meta_data_obj = pickle.load(f)
+        if hasattr(meta_data_obj, 'get') and 'episodes' in meta_data_obj:
+            # A series object rather than a list of metadata
+            if series_id is None:
+                series_id = getattr(meta_data_obj, 'movieID', None)
+            meta_data_obj = EpisodeTable.from_seasons(meta_data_obj['episodes'].items())
+        return self.add(meta_data_obj, series_id = series_id)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,203 @@
+"""
+Structured metrics for SubDownloader.
+
+A Metrics object counts requests, retries, failures and bytes, times each
+phase of a download and records batch sizes. Every measurement is also
+sent as an event dictionary to each sink, which is any callable taking
+one argument:
+
+    metrics = Metrics(sinks = [JsonLinesSink("events.jsonl"), print])
+    sd.set_metrics(metrics)
+    ...
+    print(metrics.prometheus())
+
+SubDownloader uses NULL_METRICS by default, whose methods do nothing.
+"""
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+
+def _label_key(labels):
+    """
+    Returns labels as a sorted tuple of string pairs, so keys with labels
+    such as account = None and account = 'x' can be sorted together.
+    A label of None is written as an empty string.
+    """
+    return tuple(sorted((name, "" if value is None else str(value)) for name, value in labels.items()))
+
+
+class Metrics(object):
+    """ Collects counters, phase timers and observations """
+
+    enabled = True
+
+    def __init__(self, sinks = None, prefix = "subdownloader"):
+        """
+        :param sinks Callables that are given each event as a dictionary.
+        :param prefix Put before each name in the Prometheus dump.
+        """
+        self.sinks = list(sinks or [])
+        self.prefix = prefix
+        self.counters = {}  # (name, labels) -> value
+        self.timers = {}  # (phase, labels) -> [calls, seconds]
+        self.observations = {}  # (name, labels) -> [count, sum, max]
+        self.lock = threading.Lock()
+
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def event(self, name, **fields):
+        """ Sends an event to every sink """
+        if len(self.sinks) == 0:
+            return
+        record = {'event': name, 'time': time.time()}
+        record.update(fields)
+        for sink in self.sinks:
+            sink(record)
+
+    def count(self, name, value = 1, **labels):
+        """ Adds value to a counter """
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.event(name, value = value, **labels)
+
+    def observe(self, name, value, **labels):
+        """ Records a measurement such as a batch size """
+        key = (name, _label_key(labels))
+        with self.lock:
+            stats = self.observations.setdefault(key, [0, 0, value])
+            stats[0] += 1
+            stats[1] += value
+            stats[2] = max(stats[2], value)
+        self.event(name, value = value, **labels)
+
+    @contextmanager
+    def timer(self, phase, **labels):
+        """ Times the code in a with block as a phase such as 'search' """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            key = (phase, _label_key(labels))
+            with self.lock:
+                stats = self.timers.setdefault(key, [0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+            self.event('phase', phase = phase, seconds = seconds, **labels)
+
+
+    def snapshot(self):
+        """ Returns every metric as a dictionary that can be written as JSON """
+        def flat(key):
+            name, labels = key
+            return dict(labels, name = name)
+        with self.lock:
+            return {'counters': [dict(flat(key), value = value) for key, value in self.counters.items()],
+                    'phases': [dict(flat(key), calls = calls, seconds = seconds)
+                               for key, (calls, seconds) in self.timers.items()],
+                    'observations': [dict(flat(key), count = count, sum = total, max = largest)
+                                     for key, (count, total, largest) in self.observations.items()]}
+
+    def prometheus(self):
+        """ Returns the metrics in the Prometheus text format """
+        lines = []
+        def write(name, kind, samples):
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, _prometheus_labels(labels), value))
+
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append((labels, value))
+            for name, samples in counters.items():
+                write("%s_%s_total" % (self.prefix, name), "counter", samples)
+
+            timers = sorted(self.timers.items())
+            if len(timers) > 0:
+                write(self.prefix + "_phase_seconds_total", "counter",
+                      [((('phase', phase),) + labels, seconds) for (phase, labels), (calls, seconds) in timers])
+                write(self.prefix + "_phase_calls_total", "counter",
+                      [((('phase', phase),) + labels, calls) for (phase, labels), (calls, seconds) in timers])
+
+            written = set()
+            for (name, labels), (count, total, largest) in sorted(self.observations.items()):
+                metric = "%s_%s" % (self.prefix, name)
+                if name not in written:
+                    write(metric, "summary", [])
+                    written.add(name)
+                lines.append("%s_count%s %s" % (metric, _prometheus_labels(labels), count))
+                lines.append("%s_sum%s %s" % (metric, _prometheus_labels(labels), total))
+                lines.append("%s_max%s %s" % (metric, _prometheus_labels(labels), largest))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """ Writes the Prometheus text dump to a file """
+        with open(path, "w") as f:
+            f.write(self.prometheus())
+
+
+class _NullMetrics(object):
+    """ Has the methods of Metrics but records nothing """
+
+    enabled = False
+
+    def event(self, name, **fields):
+        pass
+
+    def count(self, name, value = 1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, phase, **labels):
+        return _NULL_TIMER
+
+    def snapshot(self):
+        return {'counters': [], 'phases': [], 'observations': []}
+
+    def prometheus(self):
+        return ""
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = _NullMetrics()
+
+
+class JsonLinesSink(object):
+    """ A sink that appends each event to a file as a line of JSON """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _prometheus_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace('"', '\\"'))
+                          for key, value in labels) + "}"
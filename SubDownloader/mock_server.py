@@ -0,0 +1,301 @@
+"""
+Local stand-ins for OpenSubtitles and IMDB.
+
+Serves a fixed catalogue of subtitles so downloads can be run and timed
+without the network, with optional latency, download quotas and errors:
+
+    with MockServer(catalogue_from_corpus(corpus), latency = 0.05, quota = 200) as server:
+        sd = SubDownloader(server_url = server.url, ia = MockIMDb.from_corpus(corpus))
+"""
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer
+import base64
+import gzip
+import random
+import threading
+import time
+
+
+def catalogue_from_corpus(corpus, language = 'eng'):
+    """
+    Builds a catalogue from a dictionary of IMDB ID, SRT such as the one
+    from benchmark.synthetic_corpus. Each ID gets a single subtitle file.
+    """
+    catalogue = {}
+    for n, (imdb_id, srt) in enumerate(corpus.items()):
+        catalogue[imdb_id] = [{'IDSubtitleFile': str(1000000 + n), 'SubLanguageID': language,
+                               'srt': srt}]
+    return catalogue
+
+
+class MockOpenSubtitles(object):
+    """
+    The XML-RPC methods of OpenSubtitles used by SubDownloader.
+
+    The catalogue is a dictionary of IMDB ID to a list of subtitle
+    dictionaries, each with at least 'IDSubtitleFile' and 'srt'. Any other
+    keys are returned as part of the search results.
+    """
+
+    def __init__(self, catalogue, latency = 0.0, quota = None, quotas = None,
+                 error_rate = 0.0, seed = None):
+        """
+        :param latency Seconds each call takes, or a (low, high) range.
+        :param quota Downloads each account may make. None is unlimited.
+        :param quotas A dictionary of username, quota for accounts that differ.
+        :param error_rate The share of searches and downloads answered 
+            with '503 Service Unavailable'.
+        """
+        self.latency = latency
+        self.quota = quota
+        self.quotas = quotas or {}
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.files = {}  # IDSubtitleFile -> SRT
+        self.results = {}  # IMDB ID as an int -> list of search results
+        self.tokens = {}  # token -> username
+        self.downloads = {}  # username -> subtitles downloaded
+        self.calls = {'LogIn': 0, 'SearchSubtitles': 0, 'DownloadSubtitles': 0,
+                      'errors': 0, 'limited': 0}
+        self.lock = threading.Lock()
+
+        for imdb_id, subtitles in catalogue.items():
+            number = int(str(imdb_id).replace('tt', ''))
+            self.results[number] = []
+            for subtitle in subtitles:
+                sub_id = str(subtitle['IDSubtitleFile'])
+                self.files[sub_id] = subtitle['srt']
+                result = {'IDMovieImdb': str(number), 'SubLanguageID': 'eng', 'SubFormat': 'srt',
+                          'SubDownloadsCnt': '0', 'MovieFPS': '23.976',
+                          'SubFileName': sub_id + ".srt"}
+                result.update((key, str(value)) for key, value in subtitle.items() if key != 'srt')
+                self.results[number].append(result)
+
+
+    def _call(self, name):
+        """ Counts a call, waits out the latency and decides if it fails """
+        with self.lock:
+            self.calls[name] += 1
+            if isinstance(self.latency, (tuple, list)):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.calls['errors'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def reset_quotas(self):
+        """ Starts every account's download count again, like a new day """
+        with self.lock:
+            self.downloads = {}
+
+
+    def LogIn(self, username, password, language, useragent):
+        self._call('LogIn')
+        with self.lock:
+            token = "mock%d%s" % (len(self.tokens), username)
+            self.tokens[token] = username
+        return {'status': '200 OK', 'token': token, 'seconds': 0.0}
+
+    def LogOut(self, token):
+        with self.lock:
+            self.tokens.pop(token, None)
+        return {'status': '200 OK', 'seconds': 0.0}
+
+    def SearchSubtitles(self, token, queries):
+        if self._call('SearchSubtitles'):
+            return {'status': '503 Service Unavailable', 'seconds': 0.0}
+        if token not in self.tokens:
+            return {'status': '401 Unauthorized', 'seconds': 0.0}
+        data = []
+        for query in queries:
+            language = query.get('sublanguageid', 'all')
+            number = int(str(query.get('imdbid', 0)).replace('tt', ''))
+            for result in self.results.get(number, []):
+                if language == 'all' or result['SubLanguageID'] in language.split(','):
+                    data.append(result)
+        return {'status': '200 OK', 'data': data[:500], 'seconds': 0.0}
+
+    def DownloadSubtitles(self, token, ids):
+        if self._call('DownloadSubtitles'):
+            return {'status': '503 Service Unavailable', 'seconds': 0.0}
+        if token not in self.tokens:
+            return {'status': '401 Unauthorized', 'seconds': 0.0}
+
+        ids = ids[:20]
+        username = self.tokens[token]
+        with self.lock:
+            quota = self.quotas.get(username, self.quota)
+            used = self.downloads.get(username, 0)
+            if quota is not None and used + len(ids) > quota:
+                self.calls['limited'] += 1
+                return {'status': '407 Download limit reached', 'seconds': 0.0}
+            self.downloads[username] = used + len(ids)
+
+        data = []
+        for sub_id in ids:
+            srt = self.files.get(str(sub_id))
+            if srt is not None:
+                payload = base64.b64encode(gzip.compress(srt.encode("utf-8"))).decode("ascii")
+                data.append({'idsubtitlefile': str(sub_id), 'data': payload})
+        return {'status': '200 OK', 'data': data, 'seconds': 0.0}
+
+
+class MockMovie(object):
+    """
+    Stands in for an IMDbPy Movie. Has the movieID, data and item access 
+    that SubDownloader and utils use.
+    """
+
+    def __init__(self, movieID, data):
+        self.movieID = movieID
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default = None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return list(self.data.keys())
+
+
+class MockIMDb(object):
+    """
+    Stands in for IMDb() with search_movie, get_movie, 
+    get_movie_episodes and update(movie, 'main' or 'episodes'). Pass it 
+    to SubDownloader as ia.
+    """
+
+    def __init__(self, titles, latency = 0.0):
+        """
+        :param titles A dictionary of IMDB ID to a dictionary with 'title', 
+            'kind' and, for series, 'episodes' as {season: {episode: 
+            (imdb_id, title, air_date)}}.
+        :param latency Seconds each call takes.
+        """
+        self.titles = titles
+        self.latency = latency
+        self.calls = {'search_movie': 0, 'get_movie': 0, 'update': 0, 'get_movie_episodes': 0}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_corpus(cls, corpus, title = "Mock Series", series_id = "9999999",
+                    episodes_per_season = 10, latency = 0.0):
+        """ Makes a single series whose episodes are the ID's of a corpus """
+        episodes = {}
+        for n, imdb_id in enumerate(corpus):
+            season, episode = divmod(n, episodes_per_season)
+            episodes.setdefault(season + 1, {})[episode + 1] = (
+                imdb_id, "Episode %d" % (n + 1), "%d Jan %d" % (episode + 1, 2000 + season))
+        return cls({series_id: {'title': title, 'kind': 'tv series', 'episodes': episodes}},
+                   latency = latency)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _movie(self, imdb_id, main = True):
+        """
+        Like IMDbPy, only a full lookup has the 'seasons' of a series,
+        search results don't.
+        """
+        info = self.titles[imdb_id]
+        data = {'title': info['title'], 'kind': info['kind']}
+        if main:
+            self._add_main(imdb_id, data)
+        return MockMovie(imdb_id, data)
+
+    def _add_main(self, imdb_id, data):
+        info = self.titles[imdb_id]
+        if 'episodes' in info:
+            data['seasons'] = [str(season) for season in sorted(info['episodes'])]
+
+    def search_movie(self, title):
+        self._call('search_movie')
+        term = title.lower()
+        return [self._movie(imdb_id, main = False) for imdb_id, info in self.titles.items()
+                if term in info['title'].lower()]
+
+    def get_movie(self, imdb_id):
+        self._call('get_movie')
+        return self._movie(str(imdb_id))
+
+    def _episodes(self, imdb_id, seasons = None):
+        episodes = {}
+        for season, season_episodes in self.titles[imdb_id].get('episodes', {}).items():
+            if seasons is not None and season not in seasons:
+                continue
+            episodes[season] = {}
+            for episode, (episode_id, title, air_date) in season_episodes.items():
+                episodes[season][episode] = MockMovie(episode_id, {
+                    'title': title, 'kind': 'episode', 'original air date': air_date,
+                    'season': season, 'episode': episode})
+        return episodes
+
+    def update(self, movie, info = None):
+        self._call('update')
+        if info == 'main':
+            self._add_main(movie.movieID, movie.data)
+        elif info == 'episodes':
+            movie.data['episodes'] = self._episodes(movie.movieID)
+
+    def get_movie_episodes(self, movieID, season_nums = 'all'):
+        """ Returns the episodes of some seasons like IMDbPy, as {'data': {'episodes': ...}} """
+        self._call('get_movie_episodes')
+        seasons = None
+        if season_nums != 'all':
+            if isinstance(season_nums, (int, str)):
+                season_nums = [season_nums]
+            seasons = set(int(season) for season in season_nums)
+        return {'data': {'episodes': self._episodes(str(movieID), seasons)}}
+
+
+class _ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections from busy search pools
+    request_queue_size = 128
+
+
+class MockServer(object):
+    """
+    Runs MockOpenSubtitles on a local port in a background thread.
+    The address to pass to SubDownloader is in url once started.
+    """
+
+    def __init__(self, catalogue, host = "127.0.0.1", port = 0, **options):
+        """
+        Options such as latency, quota and error_rate are passed on to 
+        MockOpenSubtitles, which is kept as api.
+        """
+        self.api = MockOpenSubtitles(catalogue, **options)
+        self.server = _ThreadedXMLRPCServer((host, port), allow_none = True,
+                                            logRequests = False)
+        self.server.register_instance(self.api)
+        self.url = "http://%s:%d/" % self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
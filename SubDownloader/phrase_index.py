@@ -0,0 +1,265 @@
+from array import array
+from bisect import bisect_right
+import os
+import sqlite3
+import zlib
+
+import SubDownloader.utils as utl
+
+
+class PhraseIndex(object):
+    """
+    An inverted index of the words in a set of subtitles, kept in SQLite.
+
+    For each word and episode the index stores the token offsets the word
+    appears at, so phrases and words near each other are found from the
+    postings of the query words alone, without reading any subtitles.
+    Offsets count the tokens process_srt gives, and each match also comes
+    with the start time of the cue it is in.
+
+    Episodes can be added or replaced at any time:
+
+        index = PhraseIndex("./Data/GoT/phrases.db")
+        index.add_all(sd.iter_download(episode_ids))
+        index.phrase("winter is coming")
+    """
+
+    def __init__(self, path):
+        """
+        :param path The SQLite file to use. Its folder is created if missing.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs "
+                          "(doc INTEGER PRIMARY KEY, key TEXT UNIQUE, n_tokens INTEGER, "
+                          "cue_offsets BLOB, cue_times BLOB, tokens BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS postings "
+                          "(token TEXT, doc INTEGER, positions BLOB, PRIMARY KEY (token, doc)) "
+                          "WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vocab "
+                          "(token TEXT PRIMARY KEY, df INTEGER) WITHOUT ROWID")
+        self.conn.commit()
+        self._docs = {}  # doc -> (key, cue offsets, cue times), filled as docs are read
+
+
+    def add(self, key, srt, commit = True):
+        """
+        Indexes the SRT of an episode under key, replacing anything
+        already indexed under it. Returns the number of tokens indexed.
+        """
+        key = str(key)
+        self._remove(key)
+
+        tokens = []
+        cue_offsets = array('I')
+        cue_times = array('q')
+        for start, words in utl.iter_srt_cues(srt):
+            if len(words) == 0:
+                continue
+            cue_offsets.append(len(tokens))
+            cue_times.append(-1 if start is None else start)
+            tokens.extend(words)
+
+        positions = {}
+        for offset, token in enumerate(tokens):
+            positions.setdefault(token, array('I')).append(offset)
+
+        cursor = self.conn.execute(
+            "INSERT INTO docs (key, n_tokens, cue_offsets, cue_times, tokens) VALUES (?, ?, ?, ?, ?)",
+            (key, len(tokens), cue_offsets.tobytes(), cue_times.tobytes(),
+             zlib.compress(" ".join(tokens).encode("utf-8"))))
+        doc = cursor.lastrowid
+        self.conn.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                              [(token, doc, offsets.tobytes()) for token, offsets in positions.items()])
+        self.conn.executemany("INSERT INTO vocab VALUES (?, 1) "
+                              "ON CONFLICT (token) DO UPDATE SET df = df + 1",
+                              [(token,) for token in positions])
+        if commit:
+            self.conn.commit()
+        return len(tokens)
+
+    def add_all(self, srt_items):
+        """
+        Indexes every (key, SRT) pair, e.g. from iter_download or
+        load_from_file(...).items(). Files that can't be read are skipped.
+        Returns the number of episodes indexed.
+        """
+        count = 0
+        for key, srt in srt_items:
+            try:
+                self.add(key, srt, commit = False)
+                count += 1
+            except ValueError:
+                print("Couldn't index the subtitles of", key)
+        self.conn.commit()
+        return count
+
+    def _remove(self, key):
+        row = self.conn.execute("SELECT doc FROM docs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        doc = row[0]
+        self.conn.execute("UPDATE vocab SET df = df - 1 WHERE token IN "
+                          "(SELECT token FROM postings WHERE doc = ?)", (doc,))
+        self.conn.execute("DELETE FROM vocab WHERE df <= 0")
+        self.conn.execute("DELETE FROM postings WHERE doc = ?", (doc,))
+        self.conn.execute("DELETE FROM docs WHERE doc = ?", (doc,))
+        self._docs.pop(doc, None)
+
+    def remove(self, key):
+        """ Removes an episode from the index """
+        self._remove(str(key))
+        self.conn.commit()
+
+    def __contains__(self, key):
+        return self.conn.execute("SELECT 1 FROM docs WHERE key = ?", (str(key),)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def keys(self):
+        return [row[0] for row in self.conn.execute("SELECT key FROM docs ORDER BY doc")]
+
+
+    def _doc(self, doc):
+        """ Returns the key, cue offsets and cue times of a doc """
+        if doc not in self._docs:
+            key, offsets, times = self.conn.execute(
+                "SELECT key, cue_offsets, cue_times FROM docs WHERE doc = ?", (doc,)).fetchone()
+            cue_offsets = array('I')
+            cue_offsets.frombytes(offsets)
+            cue_times = array('q')
+            cue_times.frombytes(times)
+            self._docs[doc] = (key, cue_offsets, cue_times)
+        return self._docs[doc]
+
+    def _match(self, doc, offset):
+        """ Returns (key, token offset, cue start in milliseconds) """
+        key, cue_offsets, cue_times = self._doc(doc)
+        cue = bisect_right(cue_offsets, offset) - 1
+        start = cue_times[cue] if cue >= 0 else -1
+        return key, offset, None if start < 0 else start
+
+    def _postings(self, token, docs = None):
+        """ Returns a dictionary of doc, array of offsets for one token """
+        if docs is None:
+            rows = self.conn.execute("SELECT doc, positions FROM postings WHERE token = ?", (token,))
+        else:
+            docs = list(docs)
+            rows = []
+            # Stay under SQLite's limit on query parameters
+            for i in range(0, len(docs), 900):
+                chunk = docs[i:i+900]
+                rows.extend(self.conn.execute(
+                    "SELECT doc, positions FROM postings WHERE token = ? AND doc IN (%s)"
+                    % ",".join("?" * len(chunk)), [token] + chunk))
+        postings = {}
+        for doc, blob in rows:
+            offsets = array('I')
+            offsets.frombytes(blob)
+            postings[doc] = offsets
+        return postings
+
+    def _by_rarity(self, tokens):
+        """ Returns the distinct tokens with the rarest first, or None if one isn't indexed """
+        counts = {}
+        for token in set(tokens):
+            row = self.conn.execute("SELECT df FROM vocab WHERE token = ?", (token,)).fetchone()
+            if row is None:
+                return None
+            counts[token] = row[0]
+        return sorted(counts, key = counts.get)
+
+    def _tokenize(self, query):
+        if isinstance(query, str):
+            return utl.WORD_PATTERN.findall(query.lower())
+        return list(query)
+
+    def document_frequency(self, token):
+        """ Returns the number of episodes a word appears in """
+        row = self.conn.execute("SELECT df FROM vocab WHERE token = ?", (token,)).fetchone()
+        return 0 if row is None else row[0]
+
+
+    def phrase(self, query, limit = None):
+        """
+        Finds every place a phrase appears. The query is tokenized like
+        process_srt, or can be given as a list of tokens.
+
+        Returns a list of (key, token offset, cue start in milliseconds)
+        in episode and offset order. The start is None for cues whose
+        timing couldn't be read.
+        """
+        tokens = self._tokenize(query)
+        if len(tokens) == 0:
+            return []
+        order = self._by_rarity(tokens)
+        if order is None:
+            return []
+
+        # Start from the rarest word and only look up episodes still in the running
+        postings = {}
+        docs = None
+        for token in order:
+            postings[token] = self._postings(token, docs)
+            docs = set(postings[token])
+            if len(docs) == 0:
+                return []
+
+        matches = []
+        for doc in sorted(docs):
+            first = postings[tokens[0]][doc]
+            others = [(i, set(postings[token][doc])) for i, token in enumerate(tokens) if i > 0]
+            for offset in first:
+                if all(offset + i in offsets for i, offsets in others):
+                    matches.append(self._match(doc, offset))
+                    if limit is not None and len(matches) >= limit:
+                        return matches
+        return matches
+
+    def near(self, word_a, word_b, window = 10, limit = None):
+        """
+        Finds every place two words (or phrases) appear within window
+        tokens of each other, in either order.
+
+        Returns a list of (key, offset of a, offset of b, cue start of a).
+        """
+        hits_a = self.phrase(word_a)
+        hits_b = self.phrase(word_b)
+        by_key = {}
+        for key, offset, start in hits_b:
+            by_key.setdefault(key, []).append(offset)
+
+        matches = []
+        for key, offset_a, start in hits_a:
+            for offset_b in by_key.get(key, ()):
+                if offset_b != offset_a and abs(offset_b - offset_a) <= window:
+                    matches.append((key, offset_a, offset_b, start))
+                    if limit is not None and len(matches) >= limit:
+                        return matches
+        return matches
+
+    def concordance(self, query, width = 5, limit = None):
+        """
+        Returns the phrase matches with their context, as (key, token
+        offset, cue start, words before, matched words, words after).
+        """
+        n_tokens = len(self._tokenize(query))
+        results = []
+        tokens_by_key = {}
+        for key, offset, start in self.phrase(query, limit = limit):
+            if key not in tokens_by_key:
+                blob = self.conn.execute("SELECT tokens FROM docs WHERE key = ?", (key,)).fetchone()[0]
+                tokens_by_key[key] = zlib.decompress(blob).decode("utf-8").split(" ")
+            tokens = tokens_by_key[key]
+            results.append((key, offset, start, tokens[max(0, offset-width):offset],
+                            tokens[offset:offset+n_tokens], tokens[offset+n_tokens:offset+n_tokens+width]))
+        return results
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,68 @@
+class SubtitleRanking(object):
+    """
+    Picks the best subtitle file of each language from OpenSubtitles
+    search results.
+
+    Results are ordered by the position of their format in formats, then
+    by whether their frame rate matches fps, then by download count when
+    by_downloads is set. Ties keep the order OpenSubtitles gave.
+    """
+
+    def __init__(self, by_downloads = True, formats = ('srt',), fps = None,
+                 fps_tolerance = 0.01):
+        """
+        :param by_downloads Prefers the most downloaded files.
+        :param formats The SubFormat's wanted, best first. Other formats
+            are only used when nothing better is found.
+        :param fps The frame rate of the video, e.g. 23.976. Files made
+            for another frame rate are only used when nothing matches.
+        """
+        self.by_downloads = by_downloads
+        self.formats = list(formats or [])
+        self.fps = fps
+        self.fps_tolerance = fps_tolerance
+
+
+    def key(self, result):
+        """ Returns the sort key of one search result, smaller is better """
+        sub_format = str(result.get('SubFormat', '')).lower()
+        format_rank = self.formats.index(sub_format) if sub_format in self.formats else len(self.formats)
+
+        fps_rank = 0
+        if self.fps is not None:
+            try:
+                fps_rank = 0 if abs(float(result.get('MovieFPS')) - self.fps) <= self.fps_tolerance else 1
+            except (TypeError, ValueError):
+                fps_rank = 1
+
+        downloads = 0
+        if self.by_downloads:
+            try:
+                downloads = -int(result.get('SubDownloadsCnt', 0))
+            except (TypeError, ValueError):
+                pass
+        return (format_rank, fps_rank, downloads)
+
+    def choose(self, results, languages):
+        """ Returns a dictionary of language, best search result """
+        return choose_subtitles(sorted(results, key = self.key), languages)
+
+
+def choose_subtitles(results, languages, ranking = None):
+    """
+    Returns a dictionary of language, chosen search result for each
+    language that has one. Without a ranking the first result of each
+    language is taken, as OpenSubtitles ordered them.
+
+    :param results The search results of one IMDB ID.
+    :param languages The SubLanguageID's wanted, e.g. ['eng', 'fre'].
+    :param ranking A SubtitleRanking.
+    """
+    if ranking is not None:
+        return ranking.choose(results, languages)
+    chosen = {}
+    for result in results:
+        language = result.get('SubLanguageID')
+        if language in languages and language not in chosen:
+            chosen[language] = result
+    return chosen
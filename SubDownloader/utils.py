@@ -1,101 +1,285 @@
 # -*- coding: utf-8 -*-
 
 #import nltk, re, #pickle #string, 
-from nltk.tokenize import RegexpTokenizer
+from array import array
+import bz2
+import lzma
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import gzip
+import heapq
+import os
 import re
 import zlib
 import math
 
+# Patterns used when reading subtitle files, compiled once
+TAG_PATTERN = re.compile('<[^>]*>')
+WORD_PATTERN = re.compile(r'\w+')
+MICRODVD_PATTERN = re.compile(r'\{(\d+)\}\{(\d+)\}(.*)')
+TIMESTAMP_PATTERN = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)')
+LINE_ENDINGS = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+
 def process_srt(srt, verbose = 0, runtime = None):
     """
     Takes an SRT file as string input. Returns a single list of words.
     All punctuation, formatting tags and capitalisation is removed.
+    
+    The SRT can also be an open file or any iterable of lines.
     """
-    wordbag = []
-    tokenizer = RegexpTokenizer(r'\w+')
+    try:
+        wordbag = []
+        for words in _srt_word_chunks(srt, verbose, runtime):
+            wordbag.extend(words)
+        return wordbag
+    except Exception as e:
+            print(e)
+            raise ValueError
 
-    lines_list = srt.splitlines()
 
-    N_lines = len(lines_list)
+def iter_srt_tokens(srt, verbose = 0, runtime = None):
+    """
+    Generator version of process_srt. Yields each word as the lines are 
+    read, so an open file is never held in memory all at once.
+    Raises ValueError for files that can't be read.
+    """
     try:
-        #Get first number if exists
-        srt_check = False
+        for word in chain.from_iterable(_srt_word_chunks(srt, verbose, runtime)):
+            yield word
+    except Exception as e:
+            print(e)
+            raise ValueError
+
+
+def iter_srt_cues(srt, runtime = None, fps = 23.976):
+    """
+    Yields (start time in milliseconds, list of words) for each line of 
+    subtitle text, with the words as process_srt gives them. The start is 
+    that of the cue the line is in, or None if it can't be read.
+    
+    :param fps The frame rate used to time MicroDVD frames.
+    """
+    try:
+        for cue, words in _srt_word_chunks(srt, runtime = runtime, times = True, fps = fps):
+            yield cue[1], words
+    except Exception as e:
+            print(e)
+            raise ValueError
+
+
+def _parse_timing(timing):
+    """
+    Returns the (start, end) in milliseconds of an SRT timing line such as 
+    '00:01:02,500 --> 00:01:04,000', with None for a time that can't be read.
+    """
+    found = TIMESTAMP_PATTERN.findall(timing) if timing is not None else []
+    times = []
+    for hours, minutes, seconds, ms in found[:2]:
+        times.append(((int(hours)*60 + int(minutes))*60 + int(seconds))*1000 + int(ms[:3].ljust(3, "0")))
+    while len(times) < 2:
+        times.append(None)
+    return times[0], times[1]
+
+
+def _srt_word_chunks(srt, verbose = 0, runtime = None, times = False, fps = 23.976):
+    """
+    Yields the list of words on each line of subtitle text, or with times 
+    ((cue number, start ms, end ms), words).
+    """
+    head, lines = _split_lines(srt)
+    
+    if _is_srt(head):
+        return _srt_chunks(lines, verbose, runtime, times)
+    elif head[0]=='{':
+        return _microdvd_chunks(lines, times, fps)
+    else:
+        print("Not SRT Format -  This will create later issues.")
+        # print("File looks like,", head)
+        raise ValueError
+
+
+def _split_lines(srt):
+    """
+    Returns the first 10 characters of a subtitle and its lines. 
+    Strings are split in one go, anything else is read lazily.
+    """
+    if isinstance(srt, str):
+        return srt[:10], srt.splitlines()
+    
+    raw_lines = iter(srt)
+    first = []
+    head = ""
+    for raw in raw_lines:
+        first.append(raw)
+        # Lines given without an ending still had one in the file
+        head += raw if raw[-1:] in LINE_ENDINGS and raw != "" else raw + "\n"
+        if len(head) >= 10:
+            break
+    
+    def lines():
+        for raw in chain(first, raw_lines):
+            split = raw.splitlines()
+            if len(split) == 0:
+                yield ''
+            else:
+                for line in split:
+                    yield line
+    
+    return head[:10], _LineBuffer(lines())
+
+
+def _is_srt(head):
+    """
+    Checks the start of a subtitle for the number of the first SRT cue, 
+    allowing for a leading space or byte order mark.
+    """
+    for probe in (head[0], head[:2], head[:10].replace("\ufeff","")[:2]):
         try:
-            fnum = int(srt[0])
-            if fnum < 10:
-                srt_check = True
+            return int(probe) < 10
         except ValueError:
+            continue
+    return False
+
+
+class _LineBuffer(object):
+    """
+    Gives indexed access to lines read from an iterator. Only lines that 
+    haven't been released are kept.
+    """
+    
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = deque()
+        self.start = 0
+        self.done = False
+    
+    def get(self, i):
+        """ Returns line i, or None past the end """
+        while i - self.start >= len(self.buffer):
+            if self.done:
+                return None
             try:
-                fnum = int(srt[:2])
-                if fnum < 10:
-                    srt_check = True
-            except ValueError:
-                srt_check = False
-                try:
-                    nobyte = srt[:10].replace("\ufeff","")
-                    fnum = int(nobyte[:2])
-                    if fnum < 10:
-                        srt_check = True
-                except:
-                    srt_check = False
-        if srt_check:
-            line = 0
-            while True:
-                line += 2 # skip the number and timestep
-
-                this_line = lines_list[line]
-                while this_line !=  '':  # Collect all of the subtitle text
-                    if 'http://' not in this_line and 'www' not in this_line:
-                        cleaned_1 = re.sub('<[^>]*>', '', this_line.lower())  # Remove formatting tags
-                        cleaned_2 = tokenizer.tokenize(cleaned_1)  # Tokenize and remove punc 
-                        wordbag += cleaned_2  # Add to word bag
-
-                    line += 1  # Move to next line
-                    if line < N_lines:
-                        this_line = lines_list[line]
-                    else:
-                        break
-
-
-                while line+2 < N_lines and lines_list[line+1] == '':  # Traverse all blank lines
-                    line += 1
-
-                # Check for end of file
-                if not line+2 < N_lines:
+                self.buffer.append(next(self.lines))
+            except StopIteration:
+                self.done = True
+                return None
+        return self.buffer[i - self.start]
+    
+    def release(self, i):
+        """ Forgets every line before line i """
+        while self.start < i and len(self.buffer) > 0:
+            self.buffer.popleft()
+            self.start += 1
+    
+    def __iter__(self):
+        i = self.start
+        line = self.get(i)
+        while line is not None:
+            yield line
+            i += 1
+            self.release(i)
+            line = self.get(i)
+    
+    def __len__(self):
+        for line in self.lines:
+            self.buffer.append(line)
+        self.done = True
+        return self.start + len(self.buffer)
+
+
+def _srt_chunks(lines, verbose = 0, runtime = None, times = False):
+    """
+    Walks the cues of an SRT file in one pass, yielding the words on 
+    each line of text, or with times ((cue number, start ms, end ms), 
+    words). Stops at the first thing that isn't a cue.
+    """
+    if isinstance(lines, list):
+        # Padding means reading past the end gives None, like the buffer
+        N_lines = len(lines)
+        lines.extend([None, None, None])
+        get = lines.__getitem__
+        release = lambda i: None
+    else:
+        N_lines = None
+        get = lines.get
+        release = lines.release
+    
+    tag_sub = TAG_PATTERN.sub
+    find_words = WORD_PATTERN.findall
+    
+    line = 0
+    while True:
+        line += 2 # skip the number and timestep
+
+        this_line = get(line)
+        if this_line is None:
+            raise IndexError("list index out of range")
+        if times:
+            cue = (line-1,) + _parse_timing(get(line-1))
+        while this_line !=  '':  # Collect all of the subtitle text
+            if 'http://' not in this_line and 'www' not in this_line:
+                text = this_line.lower()
+                if '<' in text:
+                    text = tag_sub('', text)  # Remove formatting tags
+                if times:
+                    yield cue, find_words(text)
+                else:
+                    yield find_words(text)  # Tokenize and remove punc 
+
+            line += 1  # Move to next line
+            this_line = get(line)
+            if this_line is None:
+                break
+
+        while get(line+2) is not None and get(line+1) == '':  # Traverse all blank lines
+            line += 1
+
+        # Check for end of file
+        if get(line+2) is None:
+            break
+
+        # Check for end of readable text
+        if get(line+1).isdigit() and '-->' in get(line+2):
+            line+=1
+        else:
+            break 
+
+        if runtime is not None:
+            if times:
+                # break if over runtime, in whole minutes counting the hours
+                start = _parse_timing(get(line+1))[0]
+                if start is not None and start // 60000 > runtime:
                     break
+            # break if over runtime, only reading the minutes as process_srt always has
+            elif int(get(line+1)[3:5]) > runtime:
+                break
+        
+        release(line)
 
-                # Check for end of readable text
-                if lines_list[line+1].isdigit() and '-->' in lines_list[line+2]:
-                    line+=1
-                else:
-                    break 
-
-                if runtime is not None:
-                    # break if over runtime
-                    if int(lines_list[line+1][3:5]) > runtime:
-                        break
-
-            if verbose == 1:
-                print("Done on line " + str(line) + " of " + str(N_lines))
-
-            return wordbag
-        elif srt[0]=='{':
-            line = 0
-            for line in lines_list:
-                text = re.search(r'\{\d+\}\{\d+\}(.*)', line).group(1)
-                text = text.replace("|"," ")
-                text = text.replace("-"," ").lower()
-                text = tokenizer.tokenize(text)
-                wordbag+=text
-
-            return wordbag
+    if verbose == 1:
+        if N_lines is None:
+            N_lines = len(lines)
+        print("Done on line " + str(line) + " of " + str(N_lines))
+
+
+def _microdvd_chunks(lines, times = False, fps = 23.976):
+    """
+    Yields the words on each line of a MicroDVD subtitle, or with times 
+    ((line number, start ms, end ms), words) timed at fps frames a second.
+    """
+    find_words = WORD_PATTERN.findall
+    for n, line in enumerate(lines):
+        match = MICRODVD_PATTERN.search(line)
+        text = match.group(3)
+        text = text.replace("|"," ")
+        text = text.replace("-"," ").lower()
+        if times:
+            yield (n, int(int(match.group(1))*1000/fps), int(int(match.group(2))*1000/fps)), find_words(text)
         else:
-            print("Not SRT Format -  This will create later issues.")
-            # print("File looks like,", srt[0:10])
-            raise ValueError
-    except Exception as e:
-            print(e)
-            raise ValueError
+            yield find_words(text)
         
 
 
@@ -128,9 +312,20 @@ def get_episode_metas(series_obj):
         - "air_date": original air date
     """
     
-    all_episodes = []
+    all_episodes = list(iter_episode_metas(series_obj['episodes'].items()))
+            
+    print("Returning", len(all_episodes), " epsiodes.")
+    return all_episodes
+
 
-    for season, episodes in series_obj['episodes'].items():
+def iter_episode_metas(seasons):
+    """
+    Lazily yields the epsiode information of get_episode_metas from an 
+    iterable of (season, dictionary of episode number, episode), such as 
+    SubDownloader.iter_seasons, so the first season can be used before 
+    the rest have been fetched.
+    """
+    for season, episodes in seasons:
         for episode, movie_obj in episodes.items():
             try:
                 epsiode_data = {"season":season, "episode": episode, "imdb_id":movie_obj.movieID, 
@@ -138,34 +333,89 @@ def get_episode_metas(series_obj):
             except KeyError:
                 epsiode_data = {"season":season, "episode": episode, "imdb_id":movie_obj.movieID, 
                             'title':movie_obj.data['title']}
-            all_episodes.append(epsiode_data)
-            
-    print("Returning", len(all_episodes), " epsiodes.")
-    return all_episodes
+            yield epsiode_data
 
 
-def load_from_file(ids, data_path = "."):
+def load_from_file(ids, data_path = ".", cache = None, lazy = False):
     """
     Takes an array of ids or single id and loads that srt file and returns
-    the srt files in a dictionary with IDs as keys.
+    the srt files in a dictionary with IDs as keys. Gzipped <id>.srt.gz 
+    files are read when there's no <id>.srt.
+    
+    :param cache A SubtitleCache to check before the data path is read.
+    :param lazy Returns a LazySrtDict that only reads each file when it 
+        is asked for.
     """
     
     if type(ids) is int or type(ids) is str:
-        with open(data_path+str(ids)+".srt","r") as f:
-            data = f.read()
-            return {ids:data}
+        data = cache.get_by_imdb(ids) if cache is not None else None
+        if data is None:
+            data = _read_srt_file(data_path, ids)
+        return {ids:data}
     elif type(ids) is list:
+        if lazy:
+            return LazySrtDict(ids, data_path = data_path, cache = cache)
         all_data = []
         for this_id in ids:
+            this_data = cache.get_by_imdb(this_id) if cache is not None else None
+            if this_data is not None:
+                all_data.append((this_id,this_data))
+                continue
             try:
-                with open(data_path+str(this_id)+".srt","r") as f:
-                    this_data = f.read()
+                this_data = _read_srt_file(data_path, this_id)
                 all_data.append((this_id,this_data))
             except FileNotFoundError:
                 print("There wasn't a file for ", this_id)
         return dict(all_data)
+
+
+def _read_srt_file(data_path, this_id):
+    """ Reads <id>.srt from the data path, or <id>.srt.gz if there's no plain file """
+    file_name = data_path+str(this_id)+".srt"
+    if os.path.exists(file_name) or not os.path.exists(file_name+".gz"):
+        with open(file_name,"r") as f:
+            return f.read()
+    # Saved straight from OpenSubtitles, so the encoding isn't checked
+    with gzip.open(file_name+".gz", "rt", encoding = "utf-8", errors = "replace") as f:
+        return f.read()
+
+
+class LazySrtDict(Mapping):
+    """
+    A read only dictionary of ID, SRT for the files in a data path. Each 
+    SRT is read, and unzipped if needed, only when it's looked up.
+    """
+    
+    def __init__(self, ids, data_path = ".", cache = None):
+        self.data_path = data_path
+        self.cache = cache
+        self.ids = []
+        for this_id in ids:
+            file_name = data_path+str(this_id)+".srt"
+            if (os.path.exists(file_name) or os.path.exists(file_name+".gz") or
+                    (cache is not None and cache.get_sub_id(this_id) is not None)):
+                self.ids.append(this_id)
+            else:
+                print("There wasn't a file for ", this_id)
+        self._known = set(self.ids)
+    
+    def __getitem__(self, this_id):
+        if this_id not in self._known:
+            raise KeyError(this_id)
+        this_data = self.cache.get_by_imdb(this_id) if self.cache is not None else None
+        if this_data is None:
+            try:
+                this_data = _read_srt_file(self.data_path, this_id)
+            except FileNotFoundError:
+                # Known to the cache but evicted, with no file to fall back on
+                raise KeyError(this_id)
+        return this_data
     
+    def __iter__(self):
+        return iter(self.ids)
     
+    def __len__(self):
+        return len(self.ids)
     
     
 def add_srt_to_meta(meta_list, srt_dict):
@@ -186,60 +436,154 @@ def add_srt_to_meta(meta_list, srt_dict):
     return new_list
     
     
-def compress_by_token_ratio(list_of_string):
+def compress_by_token_ratio(list_of_string, backend = 'zlib'):
     """
     Takes a string that has been tokenized and finds the ratio of the 
     compressed data to the uncompressed data.
     
-    :param list_of_string A list of ordered string objects to be compressed.
+    :param list_of_string A list of ordered string objects to be compressed, 
+        or a coded document from a TokenCorpus.
+    :param backend The compressor to use, see _compressed_size.
     """
     
-    vocab_set = set(list_of_string)
-    code_set = set(list(range(1,len(vocab_set)+1)))
-    
-    # Transforming to integer code 
-    
-    ref = dict(zip(vocab_set, list(range(1,len(vocab_set)+1))))
-    
-    coded_list = [ref[tok] for tok in list_of_string]
-    
     # Join coded list into single string
-    single_string = str(coded_list).encode("utf-8")
+    single_string = _coded_string(list_of_string)
         
-    return _compress(list_of_string) / len(single_string)
+    return _compressed_size(single_string, backend) / len(single_string)
+
+def _code_tokens(list_of_string):
+    """
+    Transforms a token list to integer codes starting at 1, in order of 
+    first appearance. The corpus wide codes of a document from a 
+    TokenCorpus are coded again the same way, so a document gives the 
+    same measures as its token list whatever corpus it came from.
+    """
+    ref = {}
+    return [ref.setdefault(tok, len(ref)+1) for tok in list_of_string]
+
+def _coded_string(list_of_string):
+    """ Returns the integer codes of a token list written out as bytes """
+    return str(_code_tokens(list_of_string)).encode("utf-8")
+
+def _check_pair(a_string, b_string):
+    """ Raises if a coded document from a TokenCorpus is paired with a token list """
+    if isinstance(a_string, array) != isinstance(b_string, array):
+        raise Exception("Can't pair a coded document from a TokenCorpus with a token list")
 
-def _compress(list_of_string):
+def _compress(list_of_string, backend = 'zlib'):
     """
     Internal Compression Method using zlib compression.
-        :param list_of_string A list of ordered string objects to be compressed.
+        :param list_of_string A list of ordered string objects to be compressed, 
+            or a coded document from a TokenCorpus.
+        :param backend The compressor to use, see _compressed_size.
 
     """
-    vocab_set = set(list_of_string)
-    code_set = set(list(range(1,len(vocab_set)+1)))
-    
-    # Transforming to integer code 
-    
-    ref = dict(zip(vocab_set, list(range(1,len(vocab_set)+1))))
-    
-    coded_list = [ref[tok] for tok in list_of_string]
-    
     # Join coded list into single string
-    single_string = str(coded_list).encode("utf-8")
+    single_string = _coded_string(list_of_string)
     
-    # Use zlib to compress
-    encoded_string = zlib.compress(single_string)
+    return _compressed_size(single_string, backend)
+
+def _parse_backend(backend):
+    """ Splits a backend such as 'zlib-9' into its name and level """
+    name, _, level = backend.partition('-')
+    if name not in ('zlib', 'bz2', 'lzma'):
+        raise Exception("Not a valid compression backend")
+    if level == '':
+        level = {'zlib': -1, 'bz2': 9, 'lzma': 6}[name]
+    return name, int(level)
+
+def _compressed_size(data, backend = 'zlib'):
+    """
+    Returns the compressed length of some bytes.
     
-    return len(encoded_string) 
+    :param backend 'zlib', 'bz2' or 'lzma', optionally with a level after 
+        a dash such as 'zlib-9' or 'lzma-1'. 'zlib' uses zlib's default level.
+    """
+    name, level = _parse_backend(backend)
+    if name == 'zlib':
+        return len(zlib.compress(data, level))
+    elif name == 'bz2':
+        return len(bz2.compress(data, level))
+    else:
+        return len(lzma.compress(data, preset = level))
 
-def _hhat(list_of_string, method = 'lewisbagrow'):
-    """ Non parametric entropy estimator for a single random process. """
 
-    if method =='fastlookup':
-        word_set = set(list_of_string)
+class PrefixCompressor(object):
+    """
+    Compresses a document A once so that C(A+B) can be found for many 
+    documents B by only compressing B.
+    
+    With zlib the compressor is copied after A and B is fed to the copy. 
+    bz2 and lzma compressors can't be copied, so they compress A+B in 
+    full. The sizes are the same as _compress gives for A and A+B.
+    """
+    
+    def __init__(self, a_string, backend = 'zlib'):
+        """
+        :param a_string A list of tokens or a coded document from a TokenCorpus.
+        :param backend The compressor to use, see _compressed_size.
+        """
+        self.backend = backend
+        self.name, self.level = _parse_backend(backend)
+        
+        self.a_string = a_string
+        self.ref = {}
+        a_codes = [self.ref.setdefault(tok, len(self.ref)+1) for tok in a_string]
+        self.a_empty = len(a_codes) == 0
+        
+        # Everything of str(codes of A) except the closing bracket
+        self.prefix = str(a_codes)[:-1].encode("utf-8")
+        if self.name == 'zlib':
+            self.state = zlib.compressobj(self.level)
+            self.head = len(self.state.compress(self.prefix))
+        self._size = None
+    
+    def _size_with_tail(self, tail):
+        if self.name == 'zlib':
+            state = self.state.copy()
+            return self.head + len(state.compress(tail)) + len(state.flush())
+        return _compressed_size(self.prefix + tail, self.backend)
+    
+    def size(self):
+        """ Returns C(A) """
+        if self._size is None:
+            self._size = self._size_with_tail(b"]")
+        return self._size
+    
+    def size_with(self, b_string):
+        """ Returns C(A+B) """
+        _check_pair(self.a_string, b_string)
+        # Code B carrying on from the codes of A
+        ref = self.ref
+        new = {}
+        offset = len(ref)+1
+        b_codes = [ref.get(tok) or new.setdefault(tok, offset+len(new)) for tok in b_string]
+        
+        tail = str(b_codes)[1:]
+        if not self.a_empty and len(b_codes) > 0:
+            tail = ", " + tail
+        return self._size_with_tail(tail.encode("utf-8"))
 
-        ref = dict(zip(word_set, list(range(len(word_set)))))
+def _hhat(list_of_string, method = 'lewisbagrow'):
+    """
+    Non parametric entropy estimator for a single random process.
+    Takes a list of tokens or a coded document from a TokenCorpus.
+    
+    :param method 'suffixautomaton' finds the match lengths in close to 
+        linear time and should be used for long texts. 'fastlookup' gives 
+        the same answer more slowly. 'lewisbagrow' matches on the text of 
+        the integer codes, so can count a match where one code is the end 
+        of another.
+    """
 
-        data = [ref[w] for w in list_of_string]
+    if method == 'suffixautomaton':
+        data = _code_tokens(list_of_string)
+        
+        N = len(data)
+        
+        return N*math.log(N,2)/sum(_match_lengths(data))
+    elif method =='fastlookup':
+        data = _code_tokens(list_of_string)
         
         N = len(data)
         
@@ -271,11 +615,7 @@ def _hhat(list_of_string, method = 'lewisbagrow'):
         return N*math.log(N,2)/sum(Lambdas)
     elif method == 'lewisbagrow':
 
-        word_set = set(list_of_string)
-
-        ref = dict(zip(word_set, list(range(len(word_set)))))
-
-        data = [ref[w] for w in list_of_string]
+        data = _code_tokens(list_of_string)
         
         N = len(data)
         Lambdas = 0
@@ -289,8 +629,242 @@ def _hhat(list_of_string, method = 'lewisbagrow'):
             Lambdas += count
             pre_string += "%s  " % data[i]  # Append to previous words varible
         return N*math.log(N,2)/Lambdas
+    else:
+        raise Exception("Not a valid method")
 
 
+def _match_lengths(data):
+    """
+    Finds Lambda_i for every position of a coded list: one more than the 
+    length of the longest run starting at i that also appears entirely 
+    before i, capped at the end of the list.
+    
+    A suffix automaton of data[:i] is grown one token at a time. The 
+    current match is kept as an automaton state and a length, and each 
+    step drops the first token of the last match before extending it, 
+    so the total work is close to linear in the length of the list.
+    """
+    N = len(data)
+    
+    # Suffix automaton stored as parallel lists, state 0 is the root
+    length = [0]
+    link = [-1]
+    trans = [{}]
+    last = 0
+    
+    Lambdas = []
+    state = 0  # State holding the current match
+    match = 0  # Length of the current match
+    
+    for i in range(N):
+        # Extend the match of data[i:] through the automaton of data[:i]
+        while i+match < N:
+            next_state = trans[state].get(data[i+match])
+            if next_state is None:
+                break
+            state = next_state
+            match += 1
+        
+        Lambdas.append(min(match+1, N-i))
+        
+        # Drop the first token of the match ready for position i+1
+        if match > 0:
+            match -= 1
+            if match <= length[link[state]]:
+                state = link[state]
+        
+        # Add data[i] to the automaton
+        token = data[i]
+        current = len(length)
+        length.append(length[last]+1)
+        link.append(0)
+        trans.append({})
+        p = last
+        while p != -1 and token not in trans[p]:
+            trans[p][token] = current
+            p = link[p]
+        if p != -1:
+            q = trans[p][token]
+            if length[p]+1 == length[q]:
+                link[current] = q
+            else:
+                clone = len(length)
+                length.append(length[p]+1)
+                link.append(link[q])
+                trans.append(trans[q].copy())
+                while p != -1 and trans[p].get(token) == q:
+                    trans[p][token] = clone
+                    p = link[p]
+                link[q] = clone
+                link[current] = clone
+        last = current
+        
+        # A clone may now hold the shorter strings of the match's state
+        while state != 0 and match <= length[link[state]]:
+            state = link[state]
+    
+    return Lambdas
+
+
+
+def _windowed_match_sums(data, window, step):
+    """
+    Returns the sum of the Lambda_i of every window of a coded list, the 
+    same as summing _match_lengths of each window, without matching each 
+    window from scratch.
+    
+    Lambda_i in the window starting at s is min(L+1, s+window-i), where L 
+    is the longest run at i that also appears entirely between s and i. 
+    When a token enters the window, each earlier occurrence j of it that 
+    gives a longer run than every closer one is kept as a record (j, run). 
+    L is the run of the furthest record still inside the window, so as 
+    the window slides a position only changes when its record falls off 
+    the front. The sum is kept up to date from these changes, with the 
+    positions whose run reaches the end of the window counted apart.
+    """
+    N = len(data)
+    occurrences = {}  # token -> positions so far, in order
+    records = [None] * N  # position -> [(j, run)], furthest last
+    lambdas = [0] * N  # L+1 of the positions in the window
+    capped = [False] * N  # True while s+window-i is the smaller
+    expire = {}  # j -> positions whose current record starts at j
+    uncap = {}  # s at which a capped position stops being capped -> positions
+    totals = [0, 0, 0]  # sum of the uncapped, number capped, sum of window-i of the capped
+    
+    def place(i, s):
+        end = i + lambdas[i] - window
+        if s < end:
+            capped[i] = True
+            totals[1] += 1
+            totals[2] += window - i
+            uncap.setdefault(end, []).append(i)
+        else:
+            capped[i] = False
+            totals[0] += lambdas[i]
+    
+    def unplace(i):
+        if capped[i]:
+            totals[1] -= 1
+            totals[2] -= window - i
+        else:
+            totals[0] -= lambdas[i]
+    
+    def current(i, s):
+        found = records[i]
+        while len(found) > 0 and found[-1][0] < s:
+            found.pop()
+        if len(found) == 0:
+            return 1
+        expire.setdefault(found[-1][0], []).append(i)
+        return found[-1][1] + 1
+    
+    def add(i, s):
+        seen = occurrences.setdefault(data[i], [])
+        found = []
+        best = 0
+        for k in range(len(seen)-1, -1, -1):
+            j = seen[k]
+            if j < s:
+                break
+            most = min(i-j, N-i)
+            # Only a run longer than the best so far is a record
+            if most <= best or data[i+best] != data[j+best]:
+                continue
+            run = 1
+            while run < most and data[i+run] == data[j+run]:
+                run += 1
+            if run > best:
+                best = run
+                found.append((j, run))
+        seen.append(i)
+        records[i] = found
+        lambdas[i] = current(i, s)
+        place(i, s)
+    
+    sums = []
+    if N < window:
+        return sums
+    for i in range(window):
+        add(i, 0)
+    sums.append(totals[0] + totals[2])
+    
+    s = 0
+    while s+step+window <= N:
+        new_s = s + step
+        # Positions leaving the window
+        for i in range(s, min(new_s, s+window)):
+            unplace(i)
+            records[i] = None
+        # Capped positions whose run now fits in the window
+        for end in range(s+1, new_s+1):
+            for i in uncap.pop(end, ()):
+                if i >= new_s and capped[i] and i + lambdas[i] - window == end:
+                    totals[1] -= 1
+                    totals[2] -= window - i
+                    capped[i] = False
+                    totals[0] += lambdas[i]
+        # Positions whose record fell off the front
+        for j in range(s, min(new_s, s+window)):
+            for i in expire.pop(j, ()):
+                if i >= new_s:
+                    unplace(i)
+                    lambdas[i] = current(i, new_s)
+                    place(i, new_s)
+        # Positions entering the window
+        for i in range(max(s+window, new_s), new_s+window):
+            add(i, new_s)
+        s = new_s
+        sums.append(totals[0] + totals[1]*s + totals[2])
+    return sums
+
+def windowed_series(list_of_string, window, step = None, measure = 'entropy',
+                    entropy_method = 'suffixautomaton', backend = 'zlib'):
+    """
+    Returns an array('d') of a measure over a sliding window of tokens, 
+    one value per window. Join the token lists of several episodes to get 
+    a series across a whole show.
+    
+    :param list_of_string A list of tokens or a coded document from a TokenCorpus.
+    :param window The number of tokens in each window.
+    :param step Tokens moved between windows, defaults to half a window.
+        A shorter tail at the end of the list is left out.
+    :param measure 'entropy' gives _hhat of each window, 'compression' 
+        gives compress_by_token_ratio.
+    
+    With the default 'suffixautomaton' method and steps of at most an 
+    eighth of the window, the entropy is kept up to date as the window 
+    slides (see _windowed_match_sums), so the work barely grows as the 
+    step gets smaller. Larger steps overlap too little for this to pay, 
+    and each window is matched on its own in time linear in its length. 
+    Compression is always measured a window at a time, since the codes 
+    and so the compressed bytes change with every window.
+    """
+    if step is None:
+        step = max(1, window//2)
+    if window < 2 or step < 1:
+        raise Exception("The window needs at least two tokens and the step one")
+    if measure not in ('entropy', 'compression'):
+        raise Exception("Not a valid measure")
+    
+    data = _code_tokens(list_of_string)
+    N = len(data)
+    
+    series = array('d')
+    if measure == 'entropy' and entropy_method == 'suffixautomaton' and step*8 <= window:
+        for total in _windowed_match_sums(data, window, step):
+            series.append(window*math.log(window,2)/total)
+        return series
+    
+    for start in range(0, N-window+1, step):
+        window_data = data[start:start+window]
+        if measure == 'compression':
+            # Coded again by first appearance in the window
+            series.append(compress_by_token_ratio(window_data, backend))
+        elif entropy_method == 'suffixautomaton':
+            series.append(window*math.log(window,2)/sum(_match_lengths(window_data)))
+        else:
+            series.append(_hhat(window_data, method = entropy_method))
+    return series
 
     
 def check_sub_format(long_string):
@@ -303,27 +877,134 @@ def check_sub_format(long_string):
     return False
 
 
-def normalised_paired_compression(a_string, b_string, method = 'compression'):
+def normalised_paired_compression(a_string, b_string, method = 'compression',
+                                  entropy_method = 'lewisbagrow', backend = 'zlib'):
     """
     Returns a noramlised paired compression ratio via the formula:
         2 * C(A+B) / (C(A) + C(B))
+    
+    :param entropy_method The _hhat method used when method is 'entropy'.
+    :param backend The compressor used when method is 'compression', 
+        see _compressed_size.
     """
     if method == 'compression':
-        C_AB = _compress(a_string+b_string)
-        C_A = _compress(a_string)
-        C_B = _compress(b_string)
+        compressor = PrefixCompressor(a_string, backend)
+        C_AB = compressor.size_with(b_string)
+        C_A = compressor.size()
+        C_B = _compress(b_string, backend)
 
         return C_AB / (C_A+ C_B)
 
     elif method == 'entropy':
-        C_AB = _hhat(a_string+b_string)
-        C_A = _hhat(a_string)
-        C_B = _hhat(b_string)
+        _check_pair(a_string, b_string)
+        C_AB = _hhat(a_string+b_string, method = entropy_method)
+        C_A = _hhat(a_string, method = entropy_method)
+        C_B = _hhat(b_string, method = entropy_method)
 
         return C_AB / (C_A+ C_B)
 
     else:
         raise Exception("Not a valid method")
+
+
+def paired_compression_against(a_string, b_strings, backend = 'zlib'):
+    """
+    Returns normalised_paired_compression of one document against each of 
+    a list of documents. A is only compressed once, so each pairing costs 
+    about the compression of B.
+    """
+    compressor = PrefixCompressor(a_string, backend)
+    C_A = compressor.size()
+    return [compressor.size_with(b_string) / (C_A + _compress(b_string, backend))
+            for b_string in b_strings]
+
+
+def paired_compression_matrix(documents, method = 'compression', workers = None,
+                              top_k = None, entropy_method = 'lewisbagrow',
+                              backend = 'zlib'):
+    """
+    Finds normalised_paired_compression between every pair of documents.
+    C(A) of each document is only found once, and the rows of the matrix 
+    are shared between a pool of processes.
+    
+    :param documents A list of token lists or coded documents, or a 
+        TokenCorpus in which case its documents are used in key order.
+    :param method 'compression' or 'entropy' as in normalised_paired_compression.
+    :param workers The number of processes. Defaults to one per CPU, 
+        1 runs everything in this process.
+    :param top_k If given, returns the top_k closest other documents of 
+        each document as a list of (index, score) instead of the matrix.
+    :param entropy_method The _hhat method used when method is 'entropy'. 
+        'suffixautomaton' is much faster on long documents.
+    :param backend The compressor used when method is 'compression'.
+    
+    Returns a list of rows where matrix[i][j] is the score of documents 
+    i and j, lower meaning more alike.
+    """
+    if method not in ('compression', 'entropy'):
+        raise Exception("Not a valid method")
+    if hasattr(documents, 'documents'):
+        documents = [documents[key] for key in documents]
+    documents = list(documents)
+    if len(set(isinstance(document, array) for document in documents)) > 1:
+        raise Exception("Can't pair a coded document from a TokenCorpus with a token list")
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(documents))
+    
+    if workers <= 1:
+        _init_matrix_worker(documents, method, entropy_method, backend)
+        single_costs = [_matrix_single(i) for i in range(len(documents))]
+        matrix = [_matrix_row((i, single_costs)) for i in range(len(documents))]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_matrix_worker,
+                                 initargs = (documents, method, entropy_method, backend)) as pool:
+            single_costs = list(pool.map(_matrix_single, range(len(documents))))
+            tasks = [(i, single_costs) for i in range(len(documents))]
+            matrix = list(pool.map(_matrix_row, tasks))
+    
+    if top_k is None:
+        return matrix
+    
+    neighbours = []
+    for i, row in enumerate(matrix):
+        others = [(j, score) for j, score in enumerate(row) if j != i]
+        neighbours.append(heapq.nsmallest(top_k, others, key = lambda pair: pair[1]))
+    return neighbours
+
+
+# Set in each worker process by paired_compression_matrix
+_matrix_state = {}
+
+def _init_matrix_worker(documents, method, entropy_method, backend = 'zlib'):
+    _matrix_state['documents'] = documents
+    _matrix_state['method'] = method
+    _matrix_state['entropy_method'] = entropy_method
+    _matrix_state['backend'] = backend
+
+def _matrix_cost(tokens):
+    if _matrix_state['method'] == 'compression':
+        return _compress(tokens, _matrix_state['backend'])
+    return _hhat(tokens, method = _matrix_state['entropy_method'])
+
+def _matrix_single(i):
+    """ Returns C(A) of document i """
+    return _matrix_cost(_matrix_state['documents'][i])
+
+def _matrix_row(task):
+    """ Returns row i of the paired compression matrix given (i, C(A) of every document) """
+    i, single_costs = task
+    documents = _matrix_state['documents']
+    if _matrix_state['method'] == 'compression':
+        # Document i is compressed once for the whole row
+        C_AB = PrefixCompressor(documents[i], _matrix_state['backend']).size_with
+    else:
+        C_AB = lambda b_string: _matrix_cost(documents[i]+b_string)
+    row = []
+    for j in range(len(documents)):
+        row.append(C_AB(documents[j]) / (single_costs[i] + single_costs[j]))
+    return row
     
     
     
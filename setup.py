@@ -1,5 +1,5 @@
 # This is the SETUP file
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='SubtitleDownloader',
@@ -12,4 +12,9 @@ setup(
         "imdbpy >= 6.6",
         "python-opensubtitles",
     ],
+    entry_points={
+        'console_scripts': [
+            'subdownloader=SubDownloader.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import SubDownloader.accounts as accounts
+from SubDownloader.accounts import AccountPool
+
+
+class AccountPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "accounts.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_quota(self):
+        pool = AccountPool(quota = 10)
+        pool.add('a', 'pw')
+        pool.add('b', 'pw', quota = 5)
+        self.assertEqual(pool.best(), 'a')
+        pool.record('a', 7)
+        self.assertEqual(pool.remaining('a'), 3)
+        self.assertEqual(pool.best(), 'b')
+        pool.mark_exhausted('b')
+        self.assertEqual(pool.exhausted(), ['b'])
+        pool.record('a', 5)
+        self.assertEqual(pool.remaining('a'), 0)
+        self.assertIsNone(pool.best())
+        self.assertIsNotNone(pool.next_reset())
+
+    def test_reset(self):
+        pool = AccountPool(quota = 10)
+        pool.add('a', 'pw')
+        pool.add('b', 'pw')
+        pool.mark_exhausted('a')
+        pool.mark_exhausted('b')
+        pool.reset('a')
+        self.assertEqual(pool.exhausted(), ['b'])
+        pool.reset()
+        self.assertEqual(pool.exhausted(), [])
+        self.assertIsNone(pool.next_reset())
+
+    def test_quota_period_ends(self):
+        pool = AccountPool(quota = 10)
+        pool.add('a', 'pw')
+        pool.mark_exhausted('a')
+        # Move the end of the period into the past
+        pool.state['a']['reset_at'] -= accounts.QUOTA_PERIOD + 1
+        self.assertEqual(pool.remaining('a'), 10)
+        self.assertEqual(pool.best(), 'a')
+
+    def test_persistence(self):
+        pool = AccountPool(self.path, quota = 10)
+        pool.add('a', 'pw')
+        pool.record('a', 4)
+        pool.set_token('a', 'token')
+
+        pool = AccountPool(self.path, quota = 10)
+        # Passwords aren't saved, so the account has to be added again
+        self.assertEqual(len(pool), 0)
+        pool.add('a', 'pw')
+        self.assertEqual(pool.remaining('a'), 6)
+        self.assertEqual(pool.get_token('a'), 'token')
+        with open(self.path, "r") as f:
+            self.assertNotIn('pw', f.read())
+
+        pool.drop_token('a')
+        self.assertIsNone(AccountPool(self.path).get_token('a'))
+
+
+if __name__ == "__main__":
+    unittest.main()
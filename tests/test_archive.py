@@ -0,0 +1,70 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from SubDownloader.archive import (ArchiveWriter, SubtitleArchive, archive_from_directory,
+                                   archive_to_directory)
+
+
+SUBTITLES = {
+    "0000001": "1\n00:00:01,000 --> 00:00:02,000\nHello there\n",
+    "0000002": "1\n00:00:01,000 --> 00:00:02,000\nGeneral Kenobi\n",
+    "0000003": "{1}{25}Some|words\n",
+}
+
+
+class SubtitleArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            with ArchiveWriter(self.path + str(compress), compress = compress) as writer:
+                writer.add_all(SUBTITLES.items())
+            with SubtitleArchive(self.path + str(compress)) as archive:
+                self.assertEqual(len(archive), 3)
+                self.assertEqual(dict(archive.items()), SUBTITLES)
+                self.assertEqual(list(archive.range("0000002", "0000003")),
+                                 [(key, SUBTITLES[key]) for key in ("0000002", "0000003")])
+                self.assertIsNone(archive.get("0000004"))
+                self.assertRaises(KeyError, archive.__getitem__, "0000004")
+
+    def test_append_replaces(self):
+        with ArchiveWriter(self.path) as writer:
+            writer.add_all(SUBTITLES.items())
+        with ArchiveWriter(self.path) as writer:
+            writer.add("0000001", "répläced")
+            writer.add("0000004", "added")
+        with SubtitleArchive(self.path) as archive:
+            self.assertEqual(archive.keys(), ["0000001", "0000002", "0000003", "0000004"])
+            self.assertEqual(archive["0000001"], "répläced")
+            self.assertEqual(archive["0000002"], SUBTITLES["0000002"])
+
+    def test_directory_round_trip(self):
+        data_path = os.path.join(self.folder, "data") + os.sep
+        os.makedirs(data_path)
+        for imdb_id, srt in SUBTITLES.items():
+            if imdb_id == "0000003":
+                with gzip.open(data_path + imdb_id + ".srt.gz", "wb") as f:
+                    f.write(srt.encode("utf-8"))
+            else:
+                with open(data_path + imdb_id + ".srt", "w", encoding = "utf-8") as f:
+                    f.write(srt)
+
+        self.assertEqual(archive_from_directory(data_path, self.path), 3)
+        out_path = os.path.join(self.folder, "out") + os.sep
+        self.assertEqual(archive_to_directory(self.path, out_path), 3)
+        for imdb_id, srt in SUBTITLES.items():
+            with open(out_path + imdb_id + ".srt", "r", encoding = "utf-8") as f:
+                self.assertEqual(f.read(), srt)
+
+
+if __name__ == "__main__":
+    unittest.main()
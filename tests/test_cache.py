@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from SubDownloader.cache import SubtitleCache
+
+
+def srt(text):
+    return "1\n00:00:01,000 --> 00:00:02,000\n" + text + "\n"
+
+
+class SubtitleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_round_trip(self):
+        cache = SubtitleCache(self.folder)
+        cache.put(1, srt("one"))
+        cache.set_sub_id("0000001", 1)
+        cache.save()
+
+        cache = SubtitleCache(self.folder)
+        self.assertIn(1, cache)
+        self.assertEqual(cache.get("1"), srt("one"))
+        self.assertEqual(cache.get_by_imdb("0000001"), srt("one"))
+        self.assertIsNone(cache.get(2))
+
+    def test_lru_eviction(self):
+        size = len(srt("a").encode("utf-8"))
+        cache = SubtitleCache(self.folder, max_bytes = 3*size)
+        for sub_id, text in enumerate("abc"):
+            cache.put(sub_id, srt(text))
+        # Reading 0 makes 1 the least recently used
+        cache.get(0)
+        cache.put(3, srt("d"))
+        self.assertEqual(sorted(cache.files), ["0", "2", "3"])
+        self.assertEqual(cache.total_bytes, 3*size)
+        self.assertIsNone(cache.get(1))
+
+    def test_shared_content(self):
+        size = len(srt("a").encode("utf-8"))
+        cache = SubtitleCache(self.folder, max_bytes = 2*size)
+        cache.put(1, srt("a"))
+        cache.put(2, srt("a"))
+        # Stored once, so both fit with room to spare
+        self.assertEqual(cache.total_bytes, size)
+        cache.put(3, srt("b"))
+        cache.put(4, srt("c"))
+        self.assertEqual(sorted(cache.files), ["3", "4"])
+        self.assertEqual(cache.total_bytes, 2*size)
+
+    def test_missing_file(self):
+        cache = SubtitleCache(self.folder)
+        cache.put(1, srt("a"))
+        digest = cache.files["1"][0]
+        os.remove(cache._object_file(digest))
+        self.assertIsNone(cache.get(1))
+        self.assertNotIn(1, cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import SubDownloader.utils as utl
+from SubDownloader.cues import CueTable, parse_time
+
+
+SRT = ("1\n00:00:01,000 --> 00:00:02,000\nfirst words\n\n"
+       "2\n00:10:00,000 --> 00:10:03,000\nsecond\n\n"
+       "3\n00:14:59,999 --> 00:15:02,000\nthird cue\n\n"
+       "4\n01:05:00,000 --> 01:05:01,000\nlast\n")
+
+
+class ParseTimeTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_time(1500), 1500)
+        self.assertEqual(parse_time("00:01:02,500"), 62500)
+        self.assertEqual(parse_time("1:05:00"), 3900000)
+        self.assertEqual(parse_time("00:10"), 600000)
+        self.assertEqual(parse_time("00:00:01.5"), 1500)
+        self.assertRaises(Exception, parse_time, "10")
+
+
+class CueTableTest(unittest.TestCase):
+
+    def test_from_srt(self):
+        table = CueTable.from_srt(SRT)
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.tokens, utl.process_srt(SRT))
+        self.assertEqual(table.cue(0), (1000, 2000, ["first", "words"]))
+        self.assertEqual(list(table.offsets), [0, 2, 3, 5, 6])
+
+    def test_slicing(self):
+        table = CueTable.from_srt(SRT)
+        self.assertEqual(table.cue_range("00:10", "00:15"), (1, 3))
+        self.assertEqual(table.tokens_between("00:10", "00:15"), ["second", "third", "cue"])
+        self.assertEqual(table.tokens_between("00:15"), ["last"])
+        self.assertEqual(table.first_minutes(10), ["first", "words"])
+        self.assertEqual(table.cues_between(None, 2000), [0])
+        self.assertEqual(table.cue_at("00:10:01,000"), 1)
+        self.assertIsNone(table.cue_at("00:11"))
+        self.assertEqual(table.cue_of_token(4), 2)
+
+    def test_runtime_counts_hours(self):
+        # process_srt would read 01:05 as minute 5 and keep the last cue
+        table = CueTable.from_srt(SRT, runtime = 60)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.tokens[-1], "cue")
+
+    def test_out_of_order(self):
+        table = CueTable()
+        table.add(5000, 6000, ["b"])
+        table.add(1000, 2000, ["a"])
+        self.assertFalse(table.in_order)
+        self.assertEqual(table.cues_between(0, 3000), [1])
+        self.assertEqual(table.tokens_between(0, 10000), ["b", "a"])
+        self.assertEqual(table.cue_at(1500), 1)
+        self.assertRaises(Exception, table.cue_range, 0, 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
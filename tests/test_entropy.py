@@ -0,0 +1,114 @@
+import math
+import random
+import unittest
+
+import SubDownloader.utils as utl
+from SubDownloader.corpus import TokenCorpus
+
+
+def brute_force_lambdas(data):
+    """
+    Lambda_i straight from the definition: one more than the longest run
+    starting at i that appears entirely before i, capped at the end.
+    """
+    N = len(data)
+    lambdas = []
+    for i in range(N):
+        longest = 0
+        for length in range(1, N-i+1):
+            run = data[i:i+length]
+            if any(data[j:j+length] == run for j in range(0, i-length+1)):
+                longest = length
+            else:
+                break
+        lambdas.append(min(longest+1, N-i))
+    return lambdas
+
+
+def random_tokens(rand):
+    """ A short token list, sometimes with a repeated block """
+    vocab = ["w%d" % n for n in range(rand.randint(1, 6))]
+    tokens = [rand.choice(vocab) for _ in range(rand.randint(1, 60))]
+    if rand.random() < 0.3:
+        tokens = tokens[:len(tokens)//2 + 1] * 3
+    return tokens
+
+
+class MatchLengthTest(unittest.TestCase):
+
+    def test_match_lengths_brute_force(self):
+        rand = random.Random(0)
+        for _ in range(1000):
+            data = utl._code_tokens(random_tokens(rand))
+            self.assertEqual(utl._match_lengths(data), brute_force_lambdas(data), data)
+
+    def test_suffixautomaton_matches_fastlookup(self):
+        rand = random.Random(1)
+        for _ in range(1000):
+            tokens = random_tokens(rand)
+            if len(tokens) < 2:
+                continue
+            self.assertEqual(utl._hhat(tokens, 'suffixautomaton'),
+                             utl._hhat(tokens, 'fastlookup'), tokens)
+
+    def test_known_value(self):
+        # "a b" at 2 was seen before, so its Lambda is 3
+        tokens = ["a", "b", "a", "b", "c"]
+        self.assertEqual(utl._match_lengths(utl._code_tokens(tokens)), [1, 1, 3, 2, 1])
+        self.assertAlmostEqual(utl._hhat(tokens, 'suffixautomaton'), 5*math.log(5, 2)/8)
+
+
+class CorpusCodesTest(unittest.TestCase):
+
+    def test_documents_match_token_lists(self):
+        rand = random.Random(4)
+        first = random_tokens(rand) + ["a", "b", "c"]
+        second = random_tokens(rand) + ["c", "b", "a"]
+        for order in ([first, second], [second, first]):
+            corpus = TokenCorpus()
+            for n, tokens in enumerate(order):
+                corpus.add(n, tokens)
+            for n, tokens in enumerate(order):
+                for method in ('lewisbagrow', 'suffixautomaton'):
+                    self.assertEqual(utl._hhat(corpus[n], method), utl._hhat(tokens, method))
+                self.assertEqual(utl.compress_by_token_ratio(corpus[n]),
+                                 utl.compress_by_token_ratio(tokens))
+            for method in ('compression', 'entropy'):
+                self.assertEqual(utl.normalised_paired_compression(corpus[0], corpus[1], method),
+                                 utl.normalised_paired_compression(order[0], order[1], method))
+
+    def test_mixed_pair_rejected(self):
+        corpus = TokenCorpus()
+        corpus.add(0, ["a", "b", "a"])
+        for method in ('compression', 'entropy'):
+            self.assertRaises(Exception, utl.normalised_paired_compression,
+                              corpus[0], ["a", "b"], method)
+        self.assertRaises(Exception, utl.paired_compression_matrix, [corpus[0], ["a", "b"]])
+
+
+class WindowedSeriesTest(unittest.TestCase):
+
+    def test_sliding_sums_match_each_window(self):
+        rand = random.Random(2)
+        for _ in range(1000):
+            data = utl._code_tokens(random_tokens(rand))
+            window = rand.randint(2, max(2, len(data)))
+            step = rand.randint(1, window + 3)
+            expected = [sum(utl._match_lengths(data[start:start+window]))
+                        for start in range(0, len(data)-window+1, step)]
+            self.assertEqual(utl._windowed_match_sums(data, window, step), expected,
+                             (data, window, step))
+
+    def test_series_matches_hhat(self):
+        rand = random.Random(3)
+        tokens = [rand.choice(["a", "b", "c", "d"]) for _ in range(400)]
+        for step in (5, 50):
+            series = utl.windowed_series(tokens, 100, step)
+            data = utl._code_tokens(tokens)
+            expected = [utl._hhat(data[start:start+100], 'suffixautomaton')
+                        for start in range(0, 301, step)]
+            self.assertEqual(list(series), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
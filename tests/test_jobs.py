@@ -0,0 +1,67 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from SubDownloader.benchmark import synthetic_corpus
+from SubDownloader.jobs import DownloadJob, SAVED
+from SubDownloader.mock_server import MockServer, catalogue_from_corpus
+
+try:
+    from SubDownloader.SubDownloader import SubDownloader
+except ImportError:
+    # pythonopensubtitles or IMDbPY isn't installed
+    SubDownloader = None
+
+
+@unittest.skipUnless(SubDownloader is not None, "needs pythonopensubtitles and IMDbPY")
+class QuotaJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.corpus = synthetic_corpus(30, 20)
+        self.server = MockServer(catalogue_from_corpus(self.corpus), quota = 19)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def downloader(self):
+        sd = SubDownloader(server_url = self.server.url, verbose = 0, search_workers = 1,
+                           data_path = os.path.join(self.folder, "data") + os.sep,
+                           account_file = os.path.join(self.folder, "accounts.json"))
+        sd.add_login('user', 'password')
+        return sd
+
+    def test_quota_stops_job_and_rerun_finishes(self):
+        ids = list(self.corpus)
+        manifest = os.path.join(self.folder, "manifest.json")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(Exception) as context:
+                self.downloader().download_job(ids, manifest_path = manifest)
+        self.assertEqual(str(context.exception), "Account Access Failed")
+        # The first batch of 19 fits the quota, the second is refused
+        job = DownloadJob(manifest)
+        self.assertFalse(job.is_finished())
+        self.assertEqual(len(job.with_state(SAVED)), 19)
+
+        # A new day: the server and the saved account usage both reset
+        self.server.api.reset_quotas()
+        sd = self.downloader()
+        sd.rate_limit_clean()
+        with contextlib.redirect_stdout(io.StringIO()):
+            job = sd.download_job(ids, manifest_path = manifest)
+        self.assertTrue(job.is_finished())
+        self.assertEqual(len(job.with_state(SAVED)), 30)
+        # Only what was left is downloaded again
+        self.assertEqual(self.server.api.downloads['user'], 11)
+        for imdb_id in ids:
+            self.assertTrue(os.path.exists(os.path.join(self.folder, "data", imdb_id + ".srt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
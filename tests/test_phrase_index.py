@@ -0,0 +1,65 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from SubDownloader.phrase_index import PhraseIndex
+
+
+FIRST = ("1\n00:00:01,000 --> 00:00:02,000\nWinter is coming.\n\n"
+         "2\n00:01:00,500 --> 00:01:02,000\nIs winter coming? Winter is coming!\n")
+SECOND = "1\n00:00:05,000 --> 00:00:06,000\nThe winter is long\n"
+
+
+class PhraseIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = PhraseIndex(os.path.join(self.folder, "phrases.db"))
+        self.index.add_all([("e1", FIRST), ("e2", SECOND)])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.folder)
+
+    def test_phrase(self):
+        self.assertEqual(self.index.phrase("winter is coming"),
+                         [("e1", 0, 1000), ("e1", 6, 60500)])
+        self.assertEqual(self.index.phrase(["winter", "is"]),
+                         [("e1", 0, 1000), ("e1", 6, 60500), ("e2", 1, 5000)])
+        self.assertEqual(self.index.phrase("winter is coming", limit = 1), [("e1", 0, 1000)])
+        self.assertEqual(self.index.phrase("summer is coming"), [])
+        self.assertEqual(self.index.phrase(""), [])
+
+    def test_near_and_concordance(self):
+        self.assertEqual(self.index.near("long", "winter", window = 2), [("e2", 3, 1, 5000)])
+        self.assertEqual(self.index.concordance("is long", width = 2),
+                         [("e2", 2, 5000, ["the", "winter"], ["is", "long"], [])])
+
+    def test_replace(self):
+        self.assertEqual(self.index.document_frequency("winter"), 2)
+        self.index.add("e2", "1\n00:00:05,000 --> 00:00:06,000\nSummer is coming\n")
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.document_frequency("winter"), 1)
+        self.assertEqual(self.index.document_frequency("long"), 0)
+        self.assertEqual(self.index.phrase("is coming"),
+                         [("e1", 1, 1000), ("e1", 7, 60500), ("e2", 1, 5000)])
+
+    def test_remove_and_reopen(self):
+        self.index.remove("e1")
+        self.index.close()
+        self.index = PhraseIndex(os.path.join(self.folder, "phrases.db"))
+        self.assertEqual(self.index.keys(), ["e2"])
+        self.assertNotIn("e1", self.index)
+        self.assertEqual(self.index.phrase("winter is"), [("e2", 1, 5000)])
+
+    def test_unreadable_file_skipped(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.index.add_all([("bad", "Just some text")]), 0)
+        self.assertNotIn("bad", self.index)
+
+
+if __name__ == "__main__":
+    unittest.main()
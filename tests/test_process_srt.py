@@ -0,0 +1,156 @@
+import contextlib
+import io
+import random
+import re
+import unittest
+
+import SubDownloader.utils as utl
+
+
+def reference_process_srt(srt, runtime = None):
+    """
+    process_srt as it was before it was rewritten, with nltk's
+    RegexpTokenizer swapped for the same regex. The rewritten
+    version must give the same tokens.
+    """
+    wordbag = []
+    lines_list = srt.splitlines()
+    N_lines = len(lines_list)
+    try:
+        srt_check = False
+        try:
+            srt_check = int(srt[0]) < 10
+        except ValueError:
+            try:
+                srt_check = int(srt[:2]) < 10
+            except ValueError:
+                try:
+                    srt_check = int(srt[:10].replace("\ufeff","")[:2]) < 10
+                except:
+                    srt_check = False
+        if srt_check:
+            line = 0
+            while True:
+                line += 2
+                this_line = lines_list[line]
+                while this_line != '':
+                    if 'http://' not in this_line and 'www' not in this_line:
+                        wordbag += re.findall(r'\w+', re.sub('<[^>]*>', '', this_line.lower()))
+                    line += 1
+                    if line < N_lines:
+                        this_line = lines_list[line]
+                    else:
+                        break
+                while line+2 < N_lines and lines_list[line+1] == '':
+                    line += 1
+                if not line+2 < N_lines:
+                    break
+                if lines_list[line+1].isdigit() and '-->' in lines_list[line+2]:
+                    line += 1
+                else:
+                    break
+                if runtime is not None:
+                    if int(lines_list[line+1][3:5]) > runtime:
+                        break
+            return wordbag
+        elif srt[0] == '{':
+            for line in lines_list:
+                text = re.search(r'\{\d+\}\{\d+\}(.*)', line).group(1)
+                text = text.replace("|", " ").replace("-", " ").lower()
+                wordbag += re.findall(r'\w+', text)
+            return wordbag
+        else:
+            raise ValueError
+    except Exception:
+        raise ValueError
+
+
+WORDS = ['Hello', 'world', 'İstanbul', 'ΣΟΦΟΣ', '<i>it', 'alic</i>e', "don't", 'www.x',
+         'http://a', '--', 'x|y', '42', '', '  ']
+
+
+def random_subtitle(rand):
+    """
+    A random SRT, MicroDVD or broken subtitle, with cue times up to
+    three hours.
+    """
+    kind = rand.random()
+    if kind < 0.7:
+        lines = []
+        for n in range(1, rand.randint(0, 12)):
+            number = str(n) if rand.random() > 0.05 else 'x'
+            timing = rand.choice(['%02d:%02d:%02d,000 --> %02d:%02d:%02d,500' % (
+                rand.randint(0, 2), rand.randint(0, 59), rand.randint(0, 59),
+                rand.randint(0, 2), rand.randint(0, 59), rand.randint(0, 59)), 'junk'])
+            text = ['  '.join(rand.choice(WORDS) for _ in range(rand.randint(0, 5)))
+                    for _ in range(rand.randint(0, 3))]
+            lines += [number, timing] + text + [''] * rand.randint(0, 3)
+        ending = rand.choice(['\n', '\r\n'])
+        start = rand.choice(['', '\ufeff', ' ', '\n'])
+        return start + ending.join(lines) + rand.choice(['', ending])
+    elif kind < 0.9:
+        return '\n'.join('{%d}{%d}%s' % (n, n+1, ' '.join(rand.choice(WORDS) for _ in range(3)))
+                         for n in range(rand.randint(1, 5))) + rand.choice(['', '\n'])
+    return rand.choice(['', 'abc', '12\n', '1', '1\n2'])
+
+
+def tokens_or_error(process, srt, **kwargs):
+    """ Returns the tokens, or 'ValueError' if the subtitle can't be read """
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            return process(srt, **kwargs)
+        except ValueError:
+            return 'ValueError'
+
+
+class ProcessSrtTest(unittest.TestCase):
+
+    def test_matches_reference(self):
+        rand = random.Random(0)
+        for _ in range(5000):
+            srt = random_subtitle(rand)
+            runtime = rand.choice([None, None, 5, 30])
+            expected = tokens_or_error(reference_process_srt, srt, runtime = runtime)
+            self.assertEqual(tokens_or_error(utl.process_srt, srt, runtime = runtime), expected, srt)
+            self.assertEqual(tokens_or_error(utl.process_srt, io.StringIO(srt, newline = None),
+                                             runtime = runtime), expected, srt)
+
+    def test_srt(self):
+        srt = ("1\n00:00:01,000 --> 00:00:02,000\n<i>Hello</i>, World!\n\n"
+               "2\n00:00:03,000 --> 00:00:04,000\nSee www.example.com\nIt's me\n")
+        self.assertEqual(utl.process_srt(srt), ['hello', 'world', 'it', 's', 'me'])
+
+    def test_byte_order_mark(self):
+        srt = "\ufeff1\r\n00:00:01,000 --> 00:00:02,000\r\nHello there\r\n"
+        self.assertEqual(utl.process_srt(srt), ['hello', 'there'])
+
+    def test_microdvd(self):
+        srt = "{1}{25}Hello|World\n{26}{50}Well-known - words\n"
+        self.assertEqual(utl.process_srt(srt), ['hello', 'world', 'well', 'known', 'words'])
+
+    def test_runtime(self):
+        srt = ("1\n00:00:01,000 --> 00:00:02,000\nfirst\n\n"
+               "2\n00:03:00,000 --> 00:03:01,000\nsecond\n\n"
+               "3\n00:12:00,000 --> 00:12:01,000\nthird\n")
+        self.assertEqual(utl.process_srt(srt, runtime = 10), ['first', 'second'])
+        self.assertEqual(utl.process_srt(srt), ['first', 'second', 'third'])
+
+    def test_runtime_reads_minutes_only(self):
+        # 01:05 is read as minute 5, as it always has been
+        srt = ("1\n00:00:01,000 --> 00:00:02,000\nfirst\n\n"
+               "2\n01:05:00,000 --> 01:05:01,000\nsecond\n\n"
+               "3\n01:12:00,000 --> 01:12:01,000\nthird\n")
+        self.assertEqual(utl.process_srt(srt, runtime = 10), ['first', 'second'])
+
+    def test_file_object(self):
+        srt = "1\n00:00:01,000 --> 00:00:02,000\nHello\n\n2\n00:00:03,000 --> 00:00:04,000\nagain\n"
+        self.assertEqual(utl.process_srt(io.StringIO(srt)), ['hello', 'again'])
+        self.assertEqual(list(utl.iter_srt_tokens(io.StringIO(srt))), ['hello', 'again'])
+
+    def test_not_a_subtitle(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertRaises(ValueError, utl.process_srt, "Just some text")
+
+
+if __name__ == "__main__":
+    unittest.main()